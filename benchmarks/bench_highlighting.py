@@ -0,0 +1,76 @@
+"""
+Time assigning Solr highlighting to a page of search results whose packages
+have many resources, each with extractor fulltext highlights: the previous
+scan of every resource per highlight against the resource id index.
+
+    python benchmarks/bench_highlighting.py
+"""
+from __future__ import print_function
+
+import copy
+import timeit
+
+from ckanext.satreasury import search_plugin
+
+import corpus
+
+ROWS = 20
+RESOURCES = 120
+
+
+def assign_highlighting_by_scanning(result_packages, solr_results,
+                                    highlighting):
+    for idx, solr_result in enumerate(solr_results):
+
+        index_id = solr_result['index_id']
+        package_highlighting = highlighting[index_id]
+        package_result = result_packages[idx]
+        package_result['highlighting'] = package_highlighting
+
+        for resource in package_result['resources']:
+            resource['highlighting'] = {}
+
+        for key in package_highlighting.keys():
+            match = search_plugin.RESOURCE_RE.match(key)
+            if match:
+                resource_id = match.group(1)
+                highlights = package_highlighting.pop(key)
+                for resource in package_result['resources']:
+                    if resource['id'] == resource_id:
+                        resource['highlighting']['fulltext'] = highlights
+
+
+def make_search():
+    packages = [corpus.make_package(i, RESOURCES) for i in range(ROWS)]
+    solr_results = [{'index_id': 'index-%d' % i} for i in range(ROWS)]
+    highlighting = {}
+    for i, package in enumerate(packages):
+        package_highlighting = {
+            'title': ['Eastern Cape <em>budget</em>'],
+            'notes': ['The <em>budget</em> estimates'] * 3,
+        }
+        for resource in package['resources']:
+            key = 'ckanext-extractor_%s_fulltext' % resource['id']
+            package_highlighting[key] = ['<em>budget</em> allocation'] * 5
+        highlighting['index-%d' % i] = package_highlighting
+    return packages, solr_results, highlighting
+
+
+def main():
+    search = make_search()
+    old, new = copy.deepcopy(search), copy.deepcopy(search)
+    assign_highlighting_by_scanning(*old)
+    search_plugin.assign_highlighting(*new)
+    assert old == new
+
+    print('%d packages with %d resources each' % (ROWS, RESOURCES))
+    for name, assign in [('scan resources', assign_highlighting_by_scanning),
+                         ('resource index', search_plugin.assign_highlighting)]:
+        searches = [copy.deepcopy(search) for i in range(20)]
+        times = [timeit.timeit(lambda: assign(*searches.pop()), number=1)
+                 for i in range(20)]
+        print('%-16s %8.2f ms/search' % (name, min(times) * 1000))
+
+
+if __name__ == '__main__':
+    main()
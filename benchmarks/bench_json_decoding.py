@@ -0,0 +1,50 @@
+"""
+Time decoding the validated_data_dict of a rows=100 search with the standard
+library, simplejson and ujson (where installed), and lazy decoding when the
+caller only uses some of the results.
+
+    python benchmarks/bench_json_decoding.py
+"""
+from __future__ import print_function
+
+import json
+import timeit
+
+from ckanext.satreasury import decoding
+
+import corpus
+
+ROWS = 100
+
+
+def main():
+    encoded = [json.dumps(package) for package in corpus.make_corpus(ROWS)]
+    print('%d packages, %.1f KB of JSON on average, default backend %s' % (
+        ROWS, sum(map(len, encoded)) / 1024.0 / ROWS, decoding.BACKEND))
+
+    backends = [('json', json.loads), ('default', decoding.loads)]
+    try:
+        import ujson
+    except ImportError:
+        pass
+    else:
+        backends.append(('ujson', lambda s: ujson.loads(s, precise_float=True)))
+
+    for name, loads in backends:
+        assert [loads(s) for s in encoded] == [json.loads(s) for s in encoded]
+        run(name, lambda: [loads(s) for s in encoded])
+
+    def lazy_names_of_first_ten():
+        results = [decoding.decode_package(s, lazy=True) for s in encoded]
+        return [package['name'] for package in results[:10]]
+
+    run('lazy, 10 of %d used' % ROWS, lazy_names_of_first_ten)
+
+
+def run(name, fn, number=10):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    print('%-22s %8.2f ms/search' % (name, best / number * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Per-search cost of finding valid Solr parameters and raw Solr result hooks:
+inspecting every IPackageController plugin with dir() on each search, as
+CKAN does, against the precomputed search_capabilities().
+
+    python benchmarks/bench_search_capabilities.py
+"""
+from __future__ import print_function
+
+import timeit
+
+import mock
+
+import ckan.plugins as plugins
+from ckanext.satreasury import search_plugin
+
+PLUGIN_COUNT = 10
+
+
+class Plugin(plugins.toolkit.DefaultDatasetForm):
+    """ Stands in for an IPackageController plugin with the usual spread of
+    methods for dir() to look through.
+    """
+
+    def __init__(self, i):
+        self.i = i
+
+    def update_valid_solr_parameters(self, valid_solr_parameters):
+        valid_solr_parameters.add('param_%d' % self.i)
+        return valid_solr_parameters
+
+
+def per_query_inspection():
+    valid_solr_parameters = set(search_plugin.VALID_SOLR_PARAMETERS)
+    for item in plugins.PluginImplementations(plugins.IPackageController):
+        if 'update_valid_solr_parameters' in dir(item):
+            valid_solr_parameters = item.update_valid_solr_parameters(
+                valid_solr_parameters)
+    raw_solr_results_plugins = []
+    for item in plugins.PluginImplementations(plugins.IPackageController):
+        if 'include_raw_solr_results' in dir(item):
+            raw_solr_results_plugins.append(item)
+    return valid_solr_parameters, raw_solr_results_plugins
+
+
+def precomputed():
+    capabilities = search_plugin.search_capabilities()
+    return capabilities.valid_solr_parameters, \
+        capabilities.raw_solr_results_plugins
+
+
+def main():
+    loaded = [Plugin(i) for i in range(PLUGIN_COUNT)]
+    with mock.patch.object(plugins, 'PluginImplementations',
+                           return_value=loaded):
+        search_plugin.reset_search_capabilities()
+        assert per_query_inspection()[0] == precomputed()[0]
+
+        number = 2000
+        for name, fn in [('per-query inspection', per_query_inspection),
+                         ('precomputed', precomputed)]:
+            best = min(timeit.repeat(fn, number=number, repeat=5))
+            print('%-22s %8.2f us/search' % (name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
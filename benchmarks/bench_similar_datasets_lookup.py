@@ -0,0 +1,51 @@
+"""
+Time turning a dataset name into an id the way similar_datasets used to,
+with package_show, against resolve_package_id's indexed id lookup.
+
+Needs a CKAN instance with data. Pass its config file and the names of some
+datasets, ideally ones with many resources:
+
+    python benchmarks/bench_similar_datasets_lookup.py \\
+        /etc/ckan/default/development.ini dataset-name [dataset-name ...]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+from paste.deploy import appconfig
+
+
+def load_environment(config_path):
+    from ckan.config.environment import load_environment
+    conf = appconfig('config:' + config_path)
+    load_environment(conf.global_conf, conf.local_conf)
+
+
+def main(config_path, names):
+    load_environment(config_path)
+    import ckan.model as model
+    import ckan.plugins.toolkit as tk
+    from ckanext.satreasury.similar_datasets_plugin import resolve_package_id
+
+    def package_show_id(name):
+        return tk.get_action('package_show')(
+            {'ignore_auth': True}, {'id': name})['id']
+
+    for name in names:
+        resources = len(model.Package.get(name).resources)
+        assert package_show_id(name) == resolve_package_id(name)
+        print('%s (%d resources)' % (name, resources))
+        for label, lookup in [('package_show', package_show_id),
+                              ('resolve_package_id', resolve_package_id)]:
+            number = 20
+            best = min(timeit.repeat(lambda: lookup(name), number=number,
+                                     repeat=5))
+            print('  %-20s %8.2f ms' % (label, best / number * 1000))
+            model.Session.remove()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    main(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,95 @@
+"""
+Synthetic package dicts shaped like vulekamali's budget datasets: markdown
+notes, the controlled vocabularies, an organization and resources with
+long descriptions and extractor metadata.
+"""
+
+import random
+
+FINANCIAL_YEARS = ['20%02d-%02d' % (y, y + 1) for y in range(10, 20)]
+PROVINCES = ['Eastern Cape', 'Free State', 'Gauteng', 'KwaZulu-Natal',
+             'Limpopo', 'Mpumalanga', 'North West', 'Northern Cape',
+             'Western Cape']
+FORMATS = ['PDF', 'XLSX', 'CSV', 'ZIP']
+WORDS = ('budget expenditure estimates vote programme allocation national '
+         'provincial department treasury compensation employees goods '
+         'services transfers subsidies capital assets medium term').split()
+
+
+def text(rng, words):
+    return ' '.join(rng.choice(WORDS) for i in range(words))
+
+
+def make_resource(rng, package_id, i):
+    resource_id = '%s-resource-%03d' % (package_id, i)
+    return {
+        'id': resource_id,
+        'package_id': package_id,
+        'name': text(rng, 6).title(),
+        'description': text(rng, 60),
+        'format': rng.choice(FORMATS),
+        'url': 'https://data.vulekamali.gov.za/dataset/%s/resource/%s/'
+               'download/file-%03d.pdf' % (package_id, resource_id, i),
+        'url_type': 'upload',
+        'mimetype': 'application/pdf',
+        'size': rng.randint(10000, 10000000),
+        'hash': '',
+        'state': 'active',
+        'position': i,
+        'created': '2018-02-21T12:34:56.123456',
+        'last_modified': '2018-02-22T08:00:00.000000',
+        'datastore_active': False,
+        'cache_url': None,
+        'revision_id': 'rev-%d' % i,
+        'ckanext-extractor_fulltext': None,
+    }
+
+
+def make_package(i, resource_count=20, seed=None):
+    rng = random.Random(i if seed is None else seed)
+    package_id = 'package-%05d' % i
+    province = rng.choice(PROVINCES)
+    return {
+        'id': package_id,
+        'name': 'budget-%05d' % i,
+        'title': '%s %s' % (province, text(rng, 5).title()),
+        'notes': '\n\n'.join(text(rng, 80) for p in range(4)),
+        'author': None,
+        'maintainer': None,
+        'license_id': 'cc-by',
+        'license_title': 'Creative Commons Attribution',
+        'owner_org': 'org-%02d' % (i % 40),
+        'private': False,
+        'state': 'active',
+        'type': 'dataset',
+        'metadata_created': '2018-02-21T12:34:56.123456',
+        'metadata_modified': '2018-03-01T09:10:11.121314',
+        'financial_year': rng.sample(FINANCIAL_YEARS, 2),
+        'province': [province],
+        'sphere': ['provincial'],
+        'methodology': text(rng, 40),
+        'tags': [{'name': w, 'display_name': w, 'state': 'active',
+                  'vocabulary_id': None} for w in rng.sample(WORDS, 5)],
+        'extras': [],
+        'groups': [],
+        'organization': {
+            'id': 'org-%02d' % (i % 40),
+            'name': 'department-%02d' % (i % 40),
+            'title': 'Department %02d' % (i % 40),
+            'description': text(rng, 50),
+            'image_url': 'https://example.com/logo.png',
+            'type': 'organization',
+            'is_organization': True,
+            'state': 'active',
+        },
+        'resources': [make_resource(rng, package_id, r)
+                      for r in range(resource_count)],
+        'num_resources': resource_count,
+        'num_tags': 5,
+    }
+
+
+def make_corpus(count, min_resources=5, max_resources=60):
+    rng = random.Random(0)
+    return [make_package(i, rng.randint(min_resources, max_resources))
+            for i in range(count)]
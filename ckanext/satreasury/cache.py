@@ -0,0 +1,215 @@
+"""
+Caches used to keep repeated lookups off the database, Solr and external
+APIs on hot paths.
+
+TTLCache is in-process: each process (e.g. each gunicorn worker) has its own
+copy, so entries are always given a TTL to bound staleness where explicit
+invalidation can't reach. The shared backends hold state that web and worker
+processes need to agree on.
+"""
+
+import collections
+import json
+import math
+import threading
+import time
+
+
+class TTLCache(object):
+    """ Thread-safe mapping of key to value where each entry expires ``ttl``
+    seconds after it was stored.
+
+    ``clock`` can be replaced to test expiry without sleeping.
+    """
+
+    def __init__(self, ttl, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+
+    def get_or_set(self, key, compute):
+        """ Return the cached value for key, calling ``compute()`` and storing
+        its result if there isn't a fresh one.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LRUCache(object):
+    """ Thread-safe in-process cache holding at most ``max_size`` entries,
+    evicting the least recently used. Entries also expire after ``ttl``
+    seconds. Counts hits and misses.
+    """
+
+    def __init__(self, max_size, ttl, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= self.clock():
+                self.misses += 1
+                return default
+            # Re-insert as the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self.clock() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+            }
+
+
+class MemoryBackend(object):
+    """ Shared cache backend that only shares within the current process.
+
+    Suitable for development and tests. Values can be given their own TTL in
+    seconds; None means they don't expire.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= self.clock():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._get(key)
+            return default if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def _set(self, key, value, ttl):
+        expires = None if ttl is None else self.clock() + ttl
+        self._entries[key] = (expires, value)
+
+    def add(self, key, value, ttl=None):
+        """ Set key only if it isn't already set. Returns whether it was set.
+        """
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisBackend(object):
+    """ Shared cache backend storing JSON-encoded values in Redis, shared by
+    all processes using the same Redis database.
+    """
+
+    def __init__(self, client, prefix=''):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value),
+                        ex=_redis_ttl(ttl))
+
+    def add(self, key, value, ttl=None):
+        """ Set key only if it isn't already set. Returns whether it was set.
+        """
+        return bool(self.client.set(self.prefix + key, json.dumps(value),
+                                    ex=_redis_ttl(ttl), nx=True))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def _redis_ttl(ttl):
+    # Redis only accepts whole seconds
+    return None if ttl is None else max(1, int(math.ceil(ttl)))
+
+
+_shared_backend = None
+
+
+def get_shared_backend():
+    """ The configured backend for state shared between web and worker
+    processes: ``satreasury.shared_cache_backend`` is ``redis`` (the default,
+    using CKAN's Redis) or ``memory``.
+    """
+    global _shared_backend
+    if _shared_backend is None:
+        from ckan.common import config
+        name = config.get('satreasury.shared_cache_backend', 'redis')
+        if name == 'memory':
+            _shared_backend = MemoryBackend()
+        elif name == 'redis':
+            from ckan.lib.redis import connect_to_redis
+            prefix = 'ckanext-satreasury:%s:' % config.get('ckan.site_id')
+            _shared_backend = RedisBackend(connect_to_redis(), prefix)
+        else:
+            raise ValueError(
+                'Unknown satreasury.shared_cache_backend: %r' % name)
+    return _shared_backend
@@ -0,0 +1,109 @@
+"""
+Work out whether a dataset modification changes anything published on the
+vulekamali static site, so that saves which don't (private datasets,
+drafts, saves without edits) don't cost a rebuild.
+
+A fingerprint of each dataset's published fields is kept in the shared
+cache backend and compared with the fingerprint after each save, along with
+the organization and financial years whose pages list the dataset.
+"""
+
+import hashlib
+import json
+
+from ckanext.satreasury.cache import get_shared_backend
+
+# Core fields shown on the static site
+PACKAGE_FIELDS = ['name', 'title', 'notes', 'url', 'version', 'license_id',
+                  'owner_org']
+# Extras added by SATreasuryDatasetPlugin._modify_package_schema
+EXTRA_FIELDS = ['methodology', 'notes_short', 'key_points', 'importance',
+                'use_for', 'usage']
+RESOURCE_FIELDS = ['id', 'name', 'description', 'url', 'format', 'position']
+
+FINGERPRINT_KEY = 'published:%s'
+
+
+def is_published(package):
+    return package.state == 'active' and not package.private \
+        and bool(package.owner_org)
+
+
+def public_fields(package):
+    """ The fields of a package that end up on the static site, or None if
+    the package isn't published.
+
+    Tags include the financial year, province, dimension, sphere and
+    function vocabularies.
+    """
+    if not is_published(package):
+        return None
+    fields = dict((field, getattr(package, field)) for field in PACKAGE_FIELDS)
+    extras = dict(package.extras.items())
+    fields['extras'] = dict(
+        (key, extras[key]) for key in EXTRA_FIELDS if key in extras)
+    fields['tags'] = sorted(
+        [package_tag.tag.vocabulary_id, package_tag.tag.name]
+        for package_tag in package.package_tag_all
+        if package_tag.state == 'active')
+    fields['resources'] = [
+        dict((field, getattr(resource, field)) for field in RESOURCE_FIELDS)
+        for resource in package.resources]
+    return fields
+
+
+def public_fingerprint(package):
+    fields = public_fields(package)
+    if fields is None:
+        return None
+    return hashlib.sha1(json.dumps(fields, sort_keys=True)).hexdigest()
+
+
+def published_pages(package):
+    """ The organization and financial years a published package is listed
+    under on the static site.
+    """
+    if not is_published(package):
+        return {'organizations': [], 'financial_years': []}
+    return {
+        'organizations': [package.owner_org],
+        'financial_years': sorted(
+            package_tag.tag.name
+            for package_tag in package.package_tag_all
+            if package_tag.state == 'active'
+            and package_tag.tag.vocabulary is not None
+            and package_tag.tag.vocabulary.name == 'financial_years'),
+    }
+
+
+def published_change(package, backend=None):
+    """ How the published version of package changed since this was last
+    called for it, or None if it didn't. Remembers its current version.
+
+    Changes list the dataset and the organizations and financial years it
+    was listed under before or after the change. Packages seen for the first
+    time are compared with an unpublished package.
+    """
+    backend = backend or get_shared_backend()
+    key = FINGERPRINT_KEY % package.id
+    previous = backend.get(key) or {
+        'fingerprint': None,
+        'organizations': [],
+        'financial_years': [],
+    }
+    fingerprint = public_fingerprint(package)
+    if previous['fingerprint'] == fingerprint:
+        return None
+
+    pages = published_pages(package)
+    if fingerprint is None:
+        backend.delete(key)
+    else:
+        backend.set(key, dict(pages, fingerprint=fingerprint))
+    return {
+        'datasets': [package.id],
+        'organizations': sorted(
+            set(previous['organizations']) | set(pages['organizations'])),
+        'financial_years': sorted(
+            set(previous['financial_years']) | set(pages['financial_years'])),
+    }
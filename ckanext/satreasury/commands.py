@@ -0,0 +1,42 @@
+from __future__ import print_function
+
+from ckan.lib.cli import CkanCommand
+
+
+class SATreasuryCommand(CkanCommand):
+    """ SA Treasury management commands
+
+    Usage:
+
+        paster satreasury bootstrap-vocabularies [-c <config>]
+            Create any missing controlled vocabulary tags
+
+        paster satreasury refresh-similar-datasets [-c <config>]
+            Work out the similar datasets of every public dataset
+    """
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    max_args = 1
+    min_args = 1
+
+    def command(self):
+        self._load_config()
+        cmd = self.args[0]
+
+        if cmd == 'bootstrap-vocabularies':
+            self.bootstrap_vocabularies()
+        elif cmd == 'refresh-similar-datasets':
+            self.refresh_similar_datasets()
+        else:
+            print('Command %s not recognized' % cmd)
+
+    def bootstrap_vocabularies(self):
+        from ckanext.satreasury.plugin import bootstrap_vocabularies
+        created = bootstrap_vocabularies()
+        print('Created %d controlled vocabulary tags' % created)
+
+    def refresh_similar_datasets(self):
+        from ckanext.satreasury.similar_datasets_plugin import \
+            refresh_similar_datasets
+        refreshed = refresh_similar_datasets()
+        print('Refreshed similar datasets of %d datasets' % refreshed)
@@ -0,0 +1,72 @@
+"""
+Decoding of the package dicts stored in the search index.
+
+Decoding each result's validated_data_dict is most of the CPU time of a
+search returning many rows. simplejson, which CKAN depends on, is several
+times faster than the standard library when its C extension is built; the
+standard library is used when it isn't.
+"""
+
+import collections
+import json
+
+try:
+    import simplejson
+    from simplejson.scanner import c_make_scanner
+except ImportError:
+    simplejson = c_make_scanner = None
+
+
+if c_make_scanner is not None:
+    BACKEND = 'simplejson'
+    loads = simplejson.loads
+else:
+    BACKEND = 'json'
+    loads = json.loads
+
+
+class LazyPackageDict(collections.MutableMapping):
+    """ Package dict that is only decoded from its JSON when it's first used.
+
+    Behaves as a dict, but isn't one: convert it with ``dict()`` before
+    encoding it with the standard library's json. CKAN's API encodes it
+    through ``for_json``.
+    """
+
+    def __init__(self, encoded):
+        self._encoded = encoded
+        self._decoded = None
+
+    @property
+    def decoded(self):
+        if self._decoded is None:
+            self._decoded = loads(self._encoded)
+            self._encoded = None
+        return self._decoded
+
+    def __getitem__(self, key):
+        return self.decoded[key]
+
+    def __setitem__(self, key, value):
+        self.decoded[key] = value
+
+    def __delitem__(self, key):
+        del self.decoded[key]
+
+    def __iter__(self):
+        return iter(self.decoded)
+
+    def __len__(self):
+        return len(self.decoded)
+
+    def __repr__(self):
+        if self._decoded is None:
+            return '<LazyPackageDict (not decoded)>'
+        return 'LazyPackageDict(%r)' % self._decoded
+
+    def for_json(self):
+        return self.decoded
+
+
+def decode_package(encoded, lazy=False):
+    return LazyPackageDict(encoded) if lazy else loads(encoded)
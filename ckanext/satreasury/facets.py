@@ -0,0 +1,60 @@
+"""
+The search facets on the controlled vocabularies, and how Solr should count
+each facet field.
+"""
+
+from collections import OrderedDict
+
+from ckan.common import config
+
+# Facets on the controlled vocabularies, by index field, in the order they're
+# shown on the dataset search page
+VOCABULARY_FACETS = OrderedDict([
+    ('vocab_financial_years', 'Financial Year'),
+    ('vocab_spheres', 'Sphere of Government'),
+    ('vocab_provinces', 'Province'),
+    ('vocab_functions', 'Government Functions'),
+    ('vocab_dimensions', 'Dimensions'),
+])
+
+# The vocabulary facets shown on organization pages
+ORGANIZATION_VOCABULARY_FACETS = [
+    'vocab_financial_years',
+    'vocab_provinces',
+    'vocab_dimensions',
+]
+
+
+def parse_facet_limits(value):
+    '''
+    Parse ``satreasury.facet_limits``, e.g. ``res_format:20 groups:20``, into
+    a dict of field to limit.
+    '''
+    limits = {}
+    for item in value.split():
+        field, _, limit = item.rpartition(':')
+        if not field:
+            raise ValueError('Invalid satreasury.facet_limits item: %r' % item)
+        limits[field] = int(limit)
+    return limits
+
+
+def make_field_options(facet_limits):
+    # Vocabularies only have a few dozen values, so it's cheapest for Solr to
+    # count all of them using its filter cache
+    options = dict((field, {'facet.method': 'enum', 'facet.limit': -1})
+                   for field in VOCABULARY_FACETS)
+    for field, limit in facet_limits.items():
+        options.setdefault(field, {})['facet.limit'] = limit
+    return options
+
+
+FIELD_OPTIONS = make_field_options(
+    parse_facet_limits(config.get('satreasury.facet_limits', '')))
+
+
+def facet_field_options(field):
+    '''
+    Solr facet parameters for a field, to be sent as ``f.<field>.<param>``.
+    '''
+    return FIELD_OPTIONS.get(field, {})
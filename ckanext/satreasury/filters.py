@@ -0,0 +1,87 @@
+"""
+Building Solr filter queries that make good use of Solr's filterCache.
+
+Solr caches the documents matching each ``fq`` separately, so a constraint
+shared by many searches, e.g. ``capacity:public``, is only computed once if
+it's sent as its own ``fq``, written the same way each time. Combined filter
+strings are split into their top level clauses, which are normalised, sorted
+and deduplicated.
+
+This relies on CKAN's Solr schema making AND the default operator, so that
+``+a b`` and ``a`` plus ``b`` in separate filters match the same documents.
+"""
+
+# Filters using these at the top level aren't a simple conjunction of their
+# clauses and are kept whole
+OPERATORS = set(['AND', 'OR', 'NOT', '&&', '||', '!'])
+OPENING = {'(': ')', '[': ']', '{': '}'}
+CLOSING = set(OPENING.values())
+
+
+def split_filter(fq):
+    '''
+    The top level clauses of a filter query, each without a leading ``+``.
+
+    A filter that can't safely be split, e.g. because it has local params,
+    uses boolean operators at the top level or doesn't parse, is returned
+    whole.
+    '''
+    fq = fq.strip()
+    if not fq:
+        return []
+    clauses = _top_level_clauses(fq)
+    if clauses is None or fq.startswith('{!') \
+            or any(not _is_splittable(clause) for clause in clauses):
+        return [fq]
+    return [clause[1:] if clause.startswith('+') else clause
+            for clause in clauses]
+
+
+def _is_splittable(clause):
+    return clause not in OPERATORS and clause not in ('+', '-') \
+        and not clause.endswith(':')
+
+
+def _top_level_clauses(fq):
+    clauses = []
+    current = []
+    depth = []
+    quoted = escaped = False
+    for char in fq:
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif quoted:
+            quoted = char != '"'
+        elif char == '"':
+            quoted = True
+        elif char in OPENING:
+            depth.append(OPENING[char])
+        elif char in CLOSING:
+            # Ranges may mix brackets, e.g. [2017 TO 2018}
+            if not depth:
+                return None
+            depth.pop()
+        elif char.isspace() and not depth:
+            if current:
+                clauses.append(''.join(current))
+                current = []
+            continue
+        current.append(char)
+    if quoted or depth or escaped:
+        return None
+    if current:
+        clauses.append(''.join(current))
+    return clauses
+
+
+def canonical_filters(filters):
+    '''
+    Split, deduplicate and sort filter queries so each constraint is sent to
+    Solr as its own ``fq``, the same way every time.
+    '''
+    clauses = set()
+    for fq in filters:
+        clauses.update(split_filter(fq))
+    return sorted(clauses)
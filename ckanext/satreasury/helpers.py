@@ -1,15 +1,26 @@
 import ckan.plugins.toolkit as tk
+from ckan.common import config
+from ckanext.satreasury.cache import TTLCache
+
+# Facet values needed on every homepage render. Invalidated by
+# SATreasuryDatasetPlugin.notify when a package's financial years might have
+# changed; the TTL catches changes seen by other processes.
+facet_cache = TTLCache(ttl=int(config.get('satreasury.facet_cache_ttl', 60)))
 
 
 def active_financial_years():
     """ Financial years with at least one package associated with them.
     Ascending order.
     """
-    facets = tk.get_action('package_search')(None, {
+    return facet_cache.get_or_set('active_financial_years',
+                                  query_active_financial_years)
+
+
+def query_active_financial_years():
+    facets = tk.get_action('facet_counts')(None, {
         'facet.field': ['vocab_financial_years'],
-        'rows': 0,
-    })['search_facets']['vocab_financial_years']['items']
-    return sorted(x['name'] for x in facets)
+    })['facets']
+    return sorted(facets.get('vocab_financial_years', {}))
 
 
 def latest_financial_year():
@@ -19,8 +30,29 @@ def latest_financial_year():
 
 
 def packages_for_latest_financial_year(limit=None):
-    return tk.get_action('package_search')(None, {
+    # Templates only use a few fields of some of the packages
+    return tk.get_action('package_search')({'lazy_results': True}, {
         'fq': 'vocab_financial_years:%s' % latest_financial_year(),
         'rows': limit or 100,
         'sort': 'name asc',
     })['results']
+
+
+def iter_packages_for_financial_year(financial_year=None, page_size=100):
+    """ Lazily yield every public package for a financial year (default the
+    latest), fetching page_size packages at a time.
+    """
+    financial_year = financial_year or latest_financial_year()
+    get_page = tk.get_action('financial_year_packages')
+    cursor = '*'
+    while True:
+        page = get_page({'lazy_results': True}, {
+            'financial_year': financial_year,
+            'cursor': cursor,
+            'rows': page_size,
+        })
+        for package in page['results']:
+            yield package
+        if not page['results'] or page['next_cursor'] == cursor:
+            return
+        cursor = page['next_cursor']
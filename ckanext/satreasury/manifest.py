@@ -0,0 +1,129 @@
+"""
+Manifest of what has changed since the last successful static site build,
+so that the build only needs to regenerate the affected pages.
+
+It's kept in a local JSON file, so the CKAN web processes and the worker
+that triggers builds need to share a filesystem. If the worker can't see any
+changes, it triggers a full rebuild.
+"""
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+
+from ckan.common import config
+
+log = logging.getLogger(__name__)
+
+KINDS = ['datasets', 'organizations', 'financial_years']
+ENV_VARS = {
+    'datasets': 'CHANGED_DATASETS',
+    'organizations': 'CHANGED_ORGANIZATIONS',
+    'financial_years': 'CHANGED_FINANCIAL_YEARS',
+}
+
+
+class RebuildManifest(object):
+    """ Changed datasets, organizations and financial years, each with the
+    time it was last recorded, stored at ``path``.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+
+    @contextlib.contextmanager
+    def _lock(self):
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except IOError:
+            manifest = {}
+        except ValueError:
+            log.warning("Ignoring corrupt rebuild manifest %s", self.path)
+            manifest = {}
+        for kind in KINDS:
+            manifest.setdefault(kind, {})
+        return manifest
+
+    def _write(self, manifest):
+        # Write then rename so readers never see a partial file
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp_path, self.path)
+
+    def record(self, change):
+        """ Add a change from changes.published_change. """
+        now = self.clock()
+        with self._lock():
+            manifest = self._read()
+            for kind in KINDS:
+                for item in change.get(kind, []):
+                    manifest[kind][item] = now
+            self._write(manifest)
+
+    def read(self):
+        with self._lock():
+            return self._read()
+
+    def remove(self, snapshot):
+        """ Forget the changes in snapshot, a result of read(), unless they've
+        been recorded again since.
+        """
+        with self._lock():
+            manifest = self._read()
+            for kind in KINDS:
+                for item, recorded in snapshot[kind].items():
+                    if manifest[kind].get(item) == recorded:
+                        del manifest[kind][item]
+            self._write(manifest)
+
+
+def is_empty(snapshot):
+    return not any(snapshot[kind] for kind in KINDS)
+
+
+def subtract(snapshot, other):
+    """ The changes in snapshot which aren't in other, another result of
+    read(), with the same time.
+    """
+    return dict(
+        (kind, dict((item, recorded)
+                    for item, recorded in snapshot[kind].items()
+                    if other.get(kind, {}).get(item) != recorded))
+        for kind in KINDS)
+
+
+def build_env(snapshot, limit=None):
+    """ Environment variables telling the build what to regenerate, as comma
+    separated lists. Empty for a full rebuild, which happens when nothing or
+    too much is recorded.
+    """
+    if limit is None:
+        limit = int(config.get('satreasury.rebuild_manifest_limit', 200))
+    if is_empty(snapshot) or len(snapshot['datasets']) > limit:
+        return {}
+    env = {'REBUILD_MODE': 'incremental'}
+    for kind in KINDS:
+        env[ENV_VARS[kind]] = ','.join(sorted(snapshot[kind]))
+    return env
+
+
+def get_manifest():
+    path = config.get('satreasury.rebuild_manifest_path') or os.path.join(
+        config.get('ckan.storage_path') or tempfile.gettempdir(),
+        'satreasury-rebuild-manifest.json')
+    return RebuildManifest(path)
@@ -23,7 +23,7 @@ import logging
 import os
 import time
 
-import requests
+import redis
 
 import ckan.lib.helpers as ckan_helpers
 import ckan.logic.auth as ckan_auth
@@ -32,11 +32,24 @@ import ckan.model as model
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as tk
 import ckanext.satreasury.helpers as helpers
+import changes
+import facets
+import manifest
+import rebuild
 import travis
 from ckan.common import config
+from ckanext.satreasury.cache import TTLCache, get_shared_backend
 
 log = logging.getLogger(__name__)
 
+# Tag names of all controlled vocabularies, with the version they were loaded
+# at. bootstrap_vocabularies changes the version in the shared backend so
+# every process reloads them. CKAN doesn't notify plugins of other Tag or
+# Vocabulary changes, so those are only picked up once entries expire.
+vocabulary_cache = TTLCache(
+    ttl=int(config.get('satreasury.vocabulary_cache_ttl', 3600)))
+VOCABULARY_VERSION_KEY = 'vocabularies:version'
+
 FUNCTIONS = [
      'Agriculture rural development and land reform',
      'Basic education',
@@ -94,11 +107,7 @@ class SATreasuryDatasetPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm):
     # IFacets
     def dataset_facets(self, facets_dict, package_type):
         del facets_dict['tags']
-        facets_dict['vocab_financial_years'] = 'Financial Year'
-        facets_dict['vocab_spheres'] = 'Sphere of Government'
-        facets_dict['vocab_provinces'] = 'Province'
-        facets_dict['vocab_functions'] = 'Government Functions'
-        facets_dict['vocab_dimensions'] = 'Dimensions'
+        facets_dict.update(facets.VOCABULARY_FACETS)
         # move to the end
         facets_dict['organization'] = facets_dict.pop('organization')
         facets_dict['license_id'] = facets_dict.pop('license_id')
@@ -111,9 +120,8 @@ class SATreasuryDatasetPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm):
 
     def organization_facets(self, facets_dict, organization_type, package_type):
         del facets_dict['tags']
-        facets_dict['vocab_financial_years'] = 'Financial Year'
-        facets_dict['vocab_provinces'] = 'Province'
-        facets_dict['vocab_dimensions'] = 'Dimensions'
+        for field in facets.ORGANIZATION_VOCABULARY_FACETS:
+            facets_dict[field] = facets.VOCABULARY_FACETS[field]
         # move to the end
         facets_dict['res_format'] = facets_dict.pop('res_format')
         facets_dict['organization'] = facets_dict.pop('organization')
@@ -262,178 +270,191 @@ class SATreasuryDatasetPlugin(plugins.SingletonPlugin, tk.DefaultDatasetForm):
 
     # IDomainObjectModification
     def notify(self, entity, operation):
+        if isinstance(entity, model.Package) \
+           and financial_years_may_have_changed(entity, operation):
+            helpers.facet_cache.invalidate('active_financial_years')
+
         if travis.build_trigger_enabled():
-            pending_builds = travis.get_queued_builds()
-            if pending_builds:
-                log.info("Not triggering build because already queued")
-                show_success_message_for_build(pending_builds[0])
-            else:
-                if isinstance(entity, model.Package) and entity.owner_org:
-                    try:
-                        created_request = travis.trigger_build()
-                    except requests.exceptions.HTTPError as e:
-                        ckan_helpers.flash_error("An error occurred when updating the static site data. Technical details: %s" % e.message)
+            if isinstance(entity, model.Package):
+                try:
+                    change = changes.published_change(entity)
+                    if change is None:
+                        log.info("Not triggering build because nothing published changed")
                         return
-
-                    # Get the new pending builds
-                    pending_builds = travis.get_builds_from_created_request(created_request)
-                    if not pending_builds:
-                        # Link to the list of builds if the build hasn't been created yet
-                        ckan_helpers.flash_success("vulekamali will be updated in less than an hour. <a href='%s' >Check progress of the update process.</a>" % travis.TRAVIS_WEB_URL, allow_html=True)
-                    else:
-                        show_success_message_for_build(pending_builds[0])
+                    record_change(change)
+                    rebuild.request_rebuild()
+                    travis_unavailable = rebuild.rebuild_pending()
+                except redis.exceptions.RedisError as e:
+                    log.exception("Couldn't queue static site rebuild")
+                    ckan_helpers.flash_error("An error occurred when updating the static site data. Technical details: %s" % e)
+                    return
+                if travis_unavailable:
+                    ckan_helpers.flash_notice("vulekamali can't be updated right now. It will be updated automatically when the update service is available again.")
+                else:
+                    ckan_helpers.flash_success("vulekamali will be updated in less than an hour. <a href='%s' >Check progress of the update process.</a>" % travis.TRAVIS_WEB_URL, allow_html=True)
         else:
             log.info("Not triggering build because disabled")
 
-def show_success_message_for_build(build):
-    url = travis.get_build_url(build)
-    ckan_helpers.flash_success("vulekamali will be updated in less than an hour. <a href='%s' >Check progress of the update process.</a>" % url, allow_html=True)
 
-def create_financial_years():
-    """ Ensure all necessary financial years tags exist.
-    """
-    user = tk.get_action('get_site_user')({'ignore_auth': True}, {})
-    context = {'user': user['name']}
+def record_change(change):
     try:
-        vocab = tk.get_action('vocabulary_show')(context, {'id': 'financial_years'})
-    except tk.ObjectNotFound:
-        vocab = tk.get_action('vocabulary_create')(context, {'name': 'financial_years'})
-
-    tag_create = tk.get_action('tag_create')
-    existing = set(t['name'] for t in vocab['tags'])
-    for year in set(required_financial_years()) - existing:
-        tag_create(context, {
-            'name': year,
-            'vocabulary_id': vocab['id'],
-        })
+        manifest.get_manifest().record(change)
+    except (IOError, OSError):
+        # The worker will do a full rebuild if it can't read the manifest
+        log.exception("Couldn't record change in the rebuild manifest")
 
 
-def load_financial_years():
-    create_financial_years()
-    try:
-        tag_list = tk.get_action('tag_list')
-        return tag_list(data_dict={'vocabulary_id': 'financial_years'})
-    except tk.ObjectNotFound:
-        return None
+def financial_years_may_have_changed(package, operation):
+    """ Whether a package modification could change which financial years
+    have packages associated with them.
 
+    Removing the last financial year tag from a package isn't detected and
+    is left to expire from the cache.
+    """
+    if operation != model.DomainObjectOperation.changed:
+        return True
+    vocab = model.Vocabulary.get('financial_years')
+    return bool(vocab and package.get_tags(vocab))
 
-def required_financial_years():
-    # eg. 2017-18
-    return ['%s-%s' % (y, y + 1 - 2000)
-            for y in xrange(2007, datetime.date.today().year + 2)
-            ]
 
+def bootstrap_vocabularies():
+    """ Ensure all controlled vocabularies and their tags exist. Run by the
+    ``satreasury bootstrap-vocabularies`` command.
 
-def create_functions():
-    """ Ensure all necessary function tags exist.
+    Missing tags for every vocabulary are bulk inserted in a single
+    transaction. Returns the number of tags created.
     """
-    user = tk.get_action('get_site_user')({'ignore_auth': True}, {})
-    context = {'user': user['name']}
+    session = model.Session
+    required = required_vocabulary_tags()
+    tag_table = model.meta.metadata.tables['tag']
     try:
-        vocab = tk.get_action('vocabulary_show')(context, {'id': 'functions'})
-    except tk.ObjectNotFound:
-        vocab = tk.get_action('vocabulary_create')(context, {'name': 'functions'})
-
-    tag_create = tk.get_action('tag_create')
-    existing = set(t['name'] for t in vocab['tags'])
-    for function in set(FUNCTIONS) - existing:
-        tag_create(context, {
-            'name': function,
-            'vocabulary_id': vocab['id'],
-        })
-
+        vocabs = dict(
+            (vocab.name, vocab) for vocab in
+            session.query(model.Vocabulary)
+            .filter(model.Vocabulary.name.in_(required.keys())))
+        created_vocabs = set(required) - set(vocabs)
+        for vocab_name in created_vocabs:
+            vocab = model.Vocabulary(vocab_name)
+            session.add(vocab)
+            vocabs[vocab_name] = vocab
+        session.flush()
+
+        existing = query_vocabulary_tags()
+        missing = [
+            {'name': tag_name, 'vocabulary_id': vocabs[vocab_name].id}
+            for vocab_name, tag_names in required.items()
+            for tag_name in sorted(set(tag_names))
+            if tag_name not in existing.get(vocab_name, [])
+        ]
+        if missing:
+            session.execute(tag_table.insert(), missing)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    if created_vocabs or missing:
+        # Have every process reload the vocabularies
+        try:
+            get_shared_backend().set(VOCABULARY_VERSION_KEY, time.time())
+        except redis.exceptions.RedisError as e:
+            log.warning("Couldn't tell other processes to reload the "
+                        "vocabularies before their cache expires: %s", e)
+        log.info("Created %d controlled vocabulary tags", len(missing))
+    return len(missing)
+
+
+def required_vocabulary_tags():
+    """ Registry of the controlled vocabularies: the tag names each one must
+    contain, keyed by vocabulary name.
+    """
+    return {
+        'financial_years': required_financial_years(),
+        'functions': FUNCTIONS,
+        'provinces': PROVINCES,
+        'dimensions': DIMENSIONS,
+        'spheres': SPHERES,
+    }
 
-def load_functions():
-    create_functions()
-    try:
-        tag_list = tk.get_action('tag_list')
-        return tag_list(data_dict={'vocabulary_id': 'functions'})
-    except tk.ObjectNotFound:
-        return None
 
+def query_vocabulary_tags():
+    """ Tag names of every controlled vocabulary, keyed by vocabulary name,
+    in a single query.
 
-def create_provinces():
-    """ Ensure all necessary province tags exist.
+    Vocabularies without any tags have an empty list; vocabularies that
+    don't exist are left out.
+    """
+    rows = (model.Session.query(model.Vocabulary.name, model.Tag.name)
+            .outerjoin(model.Tag, model.Tag.vocabulary_id == model.Vocabulary.id)
+            .filter(model.Vocabulary.name.in_(required_vocabulary_tags().keys()))
+            .order_by(model.Tag.name))
+    vocabularies = {}
+    for vocab_name, tag_name in rows:
+        tag_names = vocabularies.setdefault(vocab_name, [])
+        if tag_name is not None:
+            tag_names.append(tag_name)
+    return vocabularies
+
+
+def load_vocabularies():
+    """ Tag names of every controlled vocabulary keyed by vocabulary name,
+    served from the vocabulary cache unless bootstrap_vocabularies has changed
+    them since they were cached.
+
+    Vocabularies are created by bootstrap_vocabularies, so this only reads.
     """
-    user = tk.get_action('get_site_user')({'ignore_auth': True}, {})
-    context = {'user': user['name']}
     try:
-        vocab = tk.get_action('vocabulary_show')(context, {'id': 'provinces'})
-    except tk.ObjectNotFound:
-        vocab = tk.get_action('vocabulary_create')(context, {'name': 'provinces'})
-
-    tag_create = tk.get_action('tag_create')
-    existing = set(t['name'] for t in vocab['tags'])
-    for province in set(PROVINCES) - existing:
-        tag_create(context, {
-            'name': province,
-            'vocabulary_id': vocab['id'],
-        })
+        version = get_shared_backend().get(VOCABULARY_VERSION_KEY)
+        version_known = True
+    except redis.exceptions.RedisError as e:
+        # Fall back on the TTL
+        log.warning("Couldn't check the vocabulary version: %s", e)
+        version, version_known = None, False
+    cached = vocabulary_cache.get('vocabularies')
+    if cached is not None and (cached[0] == version or not version_known):
+        return cached[1]
+    vocabularies = query_vocabulary_tags()
+    vocabulary_cache.set('vocabularies', (version, vocabularies))
+    return vocabularies
+
+
+def load_vocabulary(vocab_name):
+    """ Tag names of a single vocabulary, or an empty list if it doesn't
+    exist.
+    """
+    tag_names = load_vocabularies().get(vocab_name)
+    if tag_names is None:
+        log.warning("Vocabulary %s doesn't exist. Create it with "
+                    "paster satreasury bootstrap-vocabularies", vocab_name)
+        return []
+    return tag_names
 
 
-def load_provinces():
-    create_provinces()
-    try:
-        tag_list = tk.get_action('tag_list')
-        return tag_list(data_dict={'vocabulary_id': 'provinces'})
-    except tk.ObjectNotFound:
-        return None
+def load_financial_years():
+    return load_vocabulary('financial_years')
 
 
-def create_dimensions():
-    """ Ensure all necessary dimension tags exist.
-    """
-    user = tk.get_action('get_site_user')({'ignore_auth': True}, {})
-    context = {'user': user['name']}
-    try:
-        vocab = tk.get_action('vocabulary_show')(context, {'id': 'dimensions'})
-    except tk.ObjectNotFound:
-        vocab = tk.get_action('vocabulary_create')(context, {'name': 'dimensions'})
-
-    tag_create = tk.get_action('tag_create')
-    existing = set(t['name'] for t in vocab['tags'])
-    for dimension in set(DIMENSIONS) - existing:
-        tag_create(context, {
-            'name': dimension,
-            'vocabulary_id': vocab['id'],
-        })
+def required_financial_years():
+    # eg. 2017-18
+    return ['%s-%s' % (y, y + 1 - 2000)
+            for y in xrange(2007, datetime.date.today().year + 2)
+            ]
 
 
-def load_dimensions():
-    create_dimensions()
-    try:
-        tag_list = tk.get_action('tag_list')
-        return tag_list(data_dict={'vocabulary_id': 'dimensions'})
-    except tk.ObjectNotFound:
-        return None
+def load_functions():
+    return load_vocabulary('functions')
 
 
-def create_spheres():
-    """ Ensure all necessary spheres tags exist.
-    """
-    user = tk.get_action('get_site_user')({'ignore_auth': True}, {})
-    context = {'user': user['name']}
-    try:
-        vocab = tk.get_action('vocabulary_show')(context, {'id': 'spheres'})
-    except tk.ObjectNotFound:
-        vocab = tk.get_action('vocabulary_create')(context, {'name': 'spheres'})
-
-    tag_create = tk.get_action('tag_create')
-    existing = set(t['name'] for t in vocab['tags'])
-    for sphere in set(SPHERES) - existing:
-        tag_create(context, {
-            'name': sphere,
-            'vocabulary_id': vocab['id'],
-        })
+def load_provinces():
+    return load_vocabulary('provinces')
+
+
+def load_dimensions():
+    return load_vocabulary('dimensions')
 
 
 def load_spheres():
-    create_spheres()
-    try:
-        tag_list = tk.get_action('tag_list')
-        return tag_list(data_dict={'vocabulary_id': 'spheres'})
-    except tk.ObjectNotFound:
-        return None
+    return load_vocabulary('spheres')
 
 
 class SATreasuryOrganizationPlugin(plugins.SingletonPlugin, tk.DefaultOrganizationForm):
@@ -0,0 +1,251 @@
+"""
+Background jobs that rebuild the vulekamali static site via Travis-CI.
+
+These run in a CKAN worker for the ``satreasury_rebuild`` queue
+(``paster jobs worker satreasury_rebuild``) so that dataset saves don't wait
+on the Travis API. The jobs sleep while waiting for changes to stop, so they
+have their own queue to avoid holding up other background jobs.
+
+Rebuild requests are coalesced: a build is only triggered once datasets have
+stopped changing for a quiet period, so a bulk edit results in one build.
+While Travis is unavailable a pending rebuild is recorded and retried once
+the Travis circuit breaker closes.
+"""
+
+import logging
+import time
+
+import requests
+
+import ckan.lib.jobs as jobs
+import ckanext.satreasury.manifest as manifest
+import ckanext.satreasury.travis as travis
+from ckan.common import config
+from ckanext.satreasury.cache import get_shared_backend
+
+log = logging.getLogger(__name__)
+
+LAST_CHANGE_KEY = 'rebuild:last_change'
+SCHEDULED_KEY = 'rebuild:scheduled'
+PENDING_KEY = 'rebuild:pending'
+# The last build we triggered: its request id, its mode (full or
+# incremental) and the manifest entries it covers, until it finishes
+TRIGGERED_KEY = 'rebuild:triggered'
+# Set when a full rebuild failed, so that the next build is full too
+FORCE_FULL_KEY = 'rebuild:force_full'
+
+FAILED_BUILD_STATES = ('failed', 'errored', 'canceled')
+
+REBUILD_QUEUE = config.get('satreasury.rebuild_queue', 'satreasury_rebuild')
+
+
+class RebuildScheduler(object):
+    """ Coalesces rebuild requests into a single build.
+
+    The first request after a build queues a job. That job waits until no
+    request has been seen for ``quiet_period`` seconds, or ``max_delay``
+    seconds have passed since it was scheduled, and then triggers one build.
+
+    If Travis is unavailable, the rebuild is marked as pending and another
+    job is queued which waits for ``breaker`` to let calls through again.
+
+    State is kept in ``backend`` so that it's shared by web and worker
+    processes. ``clock``, ``sleep`` and ``enqueue`` can be replaced in tests.
+    """
+
+    def __init__(self, backend, quiet_period=60, max_delay=600,
+                 breaker=travis.breaker, clock=time.time, sleep=time.sleep,
+                 enqueue=None):
+        self.backend = backend
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.clock = clock
+        self.sleep = sleep
+        self.enqueue = enqueue or enqueue_scheduled_rebuild
+
+    @property
+    def job_timeout(self):
+        """ Longest a rebuild job can take, including waiting. """
+        return self.max_delay + self.breaker.cooldown + 600
+
+    def request_rebuild(self):
+        """ Note that the static site needs rebuilding. Returns whether a new
+        rebuild job was queued.
+        """
+        now = self.clock()
+        self.backend.set(LAST_CHANGE_KEY, now)
+        if self.breaker.is_open():
+            self.backend.set(PENDING_KEY, now)
+        return self._schedule(now)
+
+    def _schedule(self, now):
+        # Expire the marker eventually in case the job is lost
+        if self.backend.add(SCHEDULED_KEY, now, ttl=self.job_timeout):
+            self.enqueue()
+            return True
+        return False
+
+    def rebuild_pending(self):
+        """ Whether a rebuild is waiting for Travis to become available. """
+        return self.backend.get(PENDING_KEY) is not None
+
+    def run(self):
+        """ Wait for things to go quiet, then rebuild the static site.
+        """
+        scheduled_at = self.backend.get(SCHEDULED_KEY) or self.clock()
+        deadline = scheduled_at + self.max_delay
+        while True:
+            now = self.clock()
+            last_change = self.backend.get(LAST_CHANGE_KEY) or 0
+            wait = min(last_change + self.quiet_period, deadline) - now
+            if wait <= 0:
+                break
+            self.sleep(wait)
+
+        # Changes from here on schedule another job, which will find the
+        # build we're about to trigger already queued.
+        self.backend.delete(SCHEDULED_KEY)
+
+        retry_in = self.breaker.seconds_until_retry()
+        if retry_in:
+            self.sleep(retry_in)
+        try:
+            build = rebuild_static_site()
+        except Exception as e:
+            if not travis_unavailable(e):
+                raise
+            log.warning("Static site rebuild postponed: %s", e)
+            now = self.clock()
+            self.backend.set(PENDING_KEY, now)
+            self._schedule(now)
+            return None
+        self.backend.delete(PENDING_KEY)
+        return build
+
+
+def travis_unavailable(error):
+    """ Whether an error calling Travis means it's unavailable, rather than
+    that the request itself was wrong.
+    """
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None and \
+            error.response.status_code in travis.RETRY_STATUSES
+    return isinstance(error, (travis.CircuitOpenError,
+                              requests.exceptions.ConnectionError,
+                              requests.exceptions.Timeout))
+
+
+def get_scheduler():
+    return RebuildScheduler(
+        get_shared_backend(),
+        quiet_period=float(config.get('satreasury.rebuild_quiet_period', 60)),
+        max_delay=float(config.get('satreasury.rebuild_max_delay', 600)),
+    )
+
+
+def request_rebuild():
+    return get_scheduler().request_rebuild()
+
+
+def rebuild_pending():
+    return get_scheduler().rebuild_pending()
+
+
+def enqueue_scheduled_rebuild():
+    # jobs.enqueue doesn't let us raise rq's default timeout of 180s, which
+    # is shorter than the scheduler can wait.
+    job = jobs.get_queue(REBUILD_QUEUE).enqueue_call(
+        func=run_scheduled_rebuild,
+        timeout=int(get_scheduler().job_timeout))
+    job.meta[u'title'] = u'Rebuild vulekamali static site'
+    job.save()
+    log.info(u'Added background job %s to rebuild the static site', job.id)
+    return job
+
+
+def run_scheduled_rebuild():
+    try:
+        return get_scheduler().run()
+    finally:
+        travis.log_latency_stats()
+
+
+def rebuild_static_site():
+    """ Trigger a static site build for the changes in the rebuild manifest,
+    unless one is already queued and nothing has changed since, or a full
+    rebuild is queued.
+
+    Changes are kept in the manifest until a build covering them passes, so
+    those of failed builds are rebuilt by the next one.
+
+    Returns the queued or newly created build, or None if Travis hasn't
+    created the build for our request yet.
+    """
+    backend = get_shared_backend()
+    rebuild_manifest = manifest.get_manifest()
+    triggered = check_triggered_build(backend, rebuild_manifest)
+    changed = rebuild_manifest.read()
+    pending_builds = travis.get_queued_builds()
+    if pending_builds:
+        if triggered and triggered['mode'] == 'full':
+            # It regenerates everything when it starts, including these
+            triggered['changed'] = changed
+            backend.set(TRIGGERED_KEY, triggered)
+            log.info("Not triggering build because a full rebuild is "
+                     "already queued: %s",
+                     travis.get_build_url(pending_builds[0]))
+            return pending_builds[0]
+        covered = triggered['changed'] if triggered else {}
+        if manifest.is_empty(manifest.subtract(changed, covered)):
+            log.info("Not triggering build because already queued: %s",
+                     travis.get_build_url(pending_builds[0]))
+            return pending_builds[0]
+
+    # A queued build only regenerates the changes it was triggered with
+    if backend.get(FORCE_FULL_KEY):
+        env = {}
+    else:
+        env = manifest.build_env(changed)
+    created_request = travis.trigger_build(env)
+    backend.set(TRIGGERED_KEY, {
+        'request_id': created_request['request']['id'],
+        'mode': 'incremental' if env else 'full',
+        'changed': changed,
+    })
+    if not env:
+        backend.delete(FORCE_FULL_KEY)
+
+    # Get the new pending builds
+    pending_builds = travis.get_builds_from_created_request(created_request)
+    if not pending_builds:
+        log.info("Triggered build request %s", created_request['request']['id'])
+        return None
+    travis.set_queued_builds(pending_builds)
+    log.info("Triggered build %s", travis.get_build_url(pending_builds[0]))
+    return pending_builds[0]
+
+
+def check_triggered_build(backend, rebuild_manifest):
+    """ Update the manifest with the outcome of the last build we triggered:
+    once it has passed, its changes are removed. If it failed they're kept
+    for the next build, which is a full rebuild if the failed one was.
+
+    Returns the build's record from TRIGGERED_KEY while it hasn't finished.
+    """
+    triggered = backend.get(TRIGGERED_KEY)
+    if triggered is None:
+        return None
+    builds = travis.get_request(triggered['request_id']).get('builds') or []
+    state = builds[0].get('state') if builds else None
+    if state == 'passed':
+        rebuild_manifest.remove(triggered['changed'])
+    elif state in FAILED_BUILD_STATES:
+        log.warning("Static site build %s %s, its changes will be rebuilt",
+                    travis.get_build_url(builds[0]), state)
+        if triggered['mode'] == 'full':
+            backend.set(FORCE_FULL_KEY, True)
+    else:
+        return triggered
+    backend.delete(TRIGGERED_KEY)
+    return None
@@ -10,10 +10,11 @@ and do the rest of the work in the IPackageController plugin.
 from ckan.common import _
 from ckan.common import config
 from ckan.lib import search
-from ckan.lib.search.common import make_connection, SearchError, SearchQueryError
+from ckan.lib.search.common import SearchError, SearchQueryError
 from ckan.lib.search.query import QUERY_FIELDS, solr_literal
 from paste.deploy.converters import asbool
 from paste.util.multidict import MultiDict
+from pylons.i18n import get_lang
 import ckan.authz as authz
 import ckan.lib.activity_streams as activity_streams
 import ckan.lib.datapreview as datapreview
@@ -30,6 +31,9 @@ import ckan.model as model
 import ckan.model.misc as misc
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as tk
+import ckanext.satreasury.helpers as helpers
+import collections
+import copy
 import datetime
 import json
 import logging
@@ -40,6 +44,11 @@ import sqlalchemy
 import uuid
 
 import re
+from ckanext.satreasury.cache import LRUCache, TTLCache
+from ckanext.satreasury.decoding import decode_package
+from ckanext.satreasury.facets import facet_field_options
+from ckanext.satreasury.filters import canonical_filters
+from ckanext.satreasury.solr import make_connection, pool_stats
 
 VALID_SOLR_PARAMETERS = search.query.VALID_SOLR_PARAMETERS.copy()
 
@@ -62,11 +71,17 @@ _text = sqlalchemy.text
 
 log = logging.getLogger(__name__)
 
+# Opt-in cache of package_search results, cleared whenever a package changes
+search_cache = LRUCache(
+    max_size=int(config.get('satreasury.search_cache_size', 0)),
+    ttl=float(config.get('satreasury.search_cache_ttl', 300)))
+
 
 class PackageSearchQuery(search.PackageSearchQuery):
     def __init__(self, **kwargs):
         super(PackageSearchQuery, self).__init__(**kwargs)
         self.highlighting = {}
+        self.next_cursor_mark = None
 
     def run(self, query, permission_labels=None, **kwargs):
         '''
@@ -84,10 +99,7 @@ class PackageSearchQuery(search.PackageSearchQuery):
         '''
         assert isinstance(query, (dict, MultiDict))
         # check that query keys are valid
-        valid_solr_parameters = VALID_SOLR_PARAMETERS
-        for item in plugins.PluginImplementations(plugins.IPackageController):
-            if 'update_valid_solr_parameters' in dir(item):
-                valid_solr_parameters = item.update_valid_solr_parameters(valid_solr_parameters)
+        valid_solr_parameters = search_capabilities().valid_solr_parameters
 
         if not set(query.keys()) <= valid_solr_parameters:
             invalid_params = [s for s in set(query.keys()) - valid_solr_parameters]
@@ -100,7 +112,8 @@ class PackageSearchQuery(search.PackageSearchQuery):
 
         # number of results
         rows_to_return = min(1000, int(query.get('rows', 10)))
-        if rows_to_return > 0:
+        # The over-fetched row would be skipped by the next cursor page
+        if rows_to_return > 0 and 'cursorMark' not in query:
             # #1683 Work around problem of last result being out of order
             #       in SOLR 1.4
             rows_to_query = rows_to_return + 1
@@ -123,13 +136,35 @@ class PackageSearchQuery(search.PackageSearchQuery):
         # only return things we should be able to see
         if permission_labels is not None:
             fq.append('+permission_labels:(%s)' % ' OR '.join(
-                solr_literal(p) for p in permission_labels))
-        query['fq'] = fq
+                solr_literal(p) for p in sorted(permission_labels)))
+
+        # Send each constraint as its own filter so Solr can cache it
+        query['fq'] = canonical_filters(fq)
+        query.pop('fq_list', None)
 
         # faceting
-        query['facet'] = query.get('facet', 'true')
-        query['facet.limit'] = query.get('facet.limit', config.get('search.facets.limit', '50'))
-        query['facet.mincount'] = query.get('facet.mincount', 1)
+        facet_fields = query.get('facet.field') or []
+        if isinstance(facet_fields, six.string_types):
+            facet_fields = [facet_fields]
+        if facet_fields:
+            # A limit asked for by the caller applies to every field
+            explicit_limit = 'facet.limit' in query
+            query['facet'] = query.get('facet', 'true')
+            query['facet.limit'] = query.get('facet.limit', config.get('search.facets.limit', '50'))
+            query['facet.mincount'] = query.get('facet.mincount', 1)
+            for field in facet_fields:
+                for param, value in facet_field_options(field).items():
+                    if param == 'facet.limit' and explicit_limit:
+                        continue
+                    query.setdefault('f.%s.%s' % (field, param), value)
+        else:
+            # Nothing to count
+            query['facet'] = 'false'
+
+        # cursors need a sort on the unique key to break ties
+        if 'cursorMark' in query and 'index_id' not in query.get('sort', ''):
+            query['sort'] = ', '.join(
+                filter(None, [query.get('sort'), 'index_id asc']))
 
         # return the package ID and search scores
         query['fl'] = query.get('fl', 'name')
@@ -166,6 +201,7 @@ class PackageSearchQuery(search.PackageSearchQuery):
         self.count = solr_response.hits
         self.results = solr_response.docs
         self.highlighting = solr_response.highlighting
+        self.next_cursor_mark = getattr(solr_response, 'nextCursorMark', None)
 
         # #1683 Filter out the last row that is sometimes out of order
         self.results = self.results[:rows_to_return]
@@ -197,6 +233,111 @@ class PackageSearchQuery(search.PackageSearchQuery):
         return query_response
 
 
+SearchCapabilities = collections.namedtuple(
+    'SearchCapabilities', ['valid_solr_parameters', 'raw_solr_results_plugins'])
+
+_search_capabilities = None
+
+
+def search_capabilities():
+    '''
+    The Solr parameters IPackageController plugins allow, and the plugins
+    that can ask for raw Solr results.
+
+    Worked out on the first search, and again after plugins are loaded or
+    unloaded, rather than inspecting every plugin on every search.
+    '''
+    global _search_capabilities
+    if _search_capabilities is None:
+        valid_solr_parameters = set(VALID_SOLR_PARAMETERS)
+        raw_solr_results_plugins = []
+        for item in plugins.PluginImplementations(plugins.IPackageController):
+            if 'update_valid_solr_parameters' in dir(item):
+                valid_solr_parameters = item.update_valid_solr_parameters(
+                    valid_solr_parameters)
+            if 'include_raw_solr_results' in dir(item):
+                raw_solr_results_plugins.append(item)
+        _search_capabilities = SearchCapabilities(
+            frozenset(valid_solr_parameters), tuple(raw_solr_results_plugins))
+    return _search_capabilities
+
+
+def reset_search_capabilities():
+    global _search_capabilities
+    _search_capabilities = None
+
+
+def search_cache_key(context, data_dict):
+    '''
+    Key for the results of a search: its parameters and the things that
+    decide which datasets the user can see and how they're shown, including
+    the language they're translated to. None if the search can't be cached.
+    '''
+    user = context.get('user')
+    if context.get('ignore_auth') or (user and authz.is_sysadmin(user)):
+        labels = None
+    else:
+        labels = sorted(lib_plugins.get_permission_labels(
+            ).get_user_dataset_labels(context['auth_user_obj']))
+    try:
+        return json.dumps([data_dict, labels, bool(context.get('for_view')),
+                           bool(context.get('lazy_results')), search_locale()],
+                          sort_keys=True)
+    except TypeError:
+        return None
+
+
+def search_locale():
+    '''
+    Languages search results are translated to, or None outside a request.
+    '''
+    try:
+        return get_lang()
+    except TypeError:
+        # No translator is registered outside a request, e.g. in a job
+        return None
+
+
+# Group and organization titles and licenses for facet items. Cleared when a
+# group or organization changes in this process; the TTL catches changes made
+# in other processes.
+facet_title_cache = TTLCache(
+    ttl=int(config.get('satreasury.facet_title_cache_ttl', 3600)))
+
+
+def group_titles(session, names):
+    '''
+    Map of group or organization name to title (None if there's no such
+    group), only querying the database for names that aren't cached.
+    '''
+    missing = object()
+    titles = {}
+    uncached = []
+    for name in names:
+        title = facet_title_cache.get(('group', name), missing)
+        if title is missing:
+            uncached.append(name)
+        else:
+            titles[name] = title
+    if uncached:
+        found = dict(session.query(model.Group.name, model.Group.title)
+                     .filter(model.Group.name.in_(uncached))
+                     .all())
+        for name in uncached:
+            titles[name] = found.get(name)
+            facet_title_cache.set(('group', name), titles[name])
+    return titles
+
+
+def licenses_by_id():
+    '''
+    The license register indexed by license id. License titles are looked up
+    when used because they're translated.
+    '''
+    return facet_title_cache.get_or_set('licenses', lambda: dict(
+        model.Package.get_license_register().items()))
+
+
 # It's probably best to keep this as close to CKAN's version as possible
 # and use IPackageController to modify whatever it can to make merging CKAN
 # updates as easy as possible.
@@ -224,6 +365,14 @@ def package_search(context, data_dict):
     for key in [key for key in data_dict.keys() if key.startswith('ext_')]:
         data_dict['extras'][key] = data_dict.pop(key)
 
+    cache_key = None
+    if search_cache.max_size:
+        cache_key = search_cache_key(context, data_dict)
+    if cache_key is not None:
+        cached_results = search_cache.get(cache_key)
+        if cached_results is not None:
+            return copy.deepcopy(cached_results)
+
     # check if some extension needs to modify the search params
     for item in plugins.PluginImplementations(plugins.IPackageController):
         data_dict = item.before_search(data_dict)
@@ -253,8 +402,12 @@ def package_search(context, data_dict):
         include_private = asbool(data_dict.pop('include_private', False))
         include_drafts = asbool(data_dict.pop('include_drafts', False))
         data_dict.setdefault('fq', '')
+        fq_list = data_dict.get('fq_list', [])
+        if isinstance(fq_list, six.string_types):
+            fq_list = [fq_list]
+        data_dict['fq_list'] = list(fq_list)
         if not include_private:
-            data_dict['fq'] = '+capacity:public ' + data_dict['fq']
+            data_dict['fq_list'].append('+capacity:public')
         if include_drafts:
             data_dict['fq'] += ' +state:(active OR draft)'
 
@@ -281,13 +434,15 @@ def package_search(context, data_dict):
                     package.pop('extras')
                 results.append(package)
         else:
+            # before_view hooks would decode every result anyway
+            lazy = context.get('lazy_results') and not context.get('for_view')
             for package in query.results:
                 # get the package object
                 package_dict = package.get(data_source)
                 ## use data in search index if there
                 if package_dict:
                     # the package_dict still needs translating when being viewed
-                    package_dict = json.loads(package_dict)
+                    package_dict = decode_package(package_dict, lazy=lazy)
                     if context.get('for_view'):
                         for item in plugins.PluginImplementations(
                                 plugins.IPackageController):
@@ -318,11 +473,14 @@ def package_search(context, data_dict):
         'sort': data_dict['sort'],
     }
 
+    if 'cursorMark' in data_dict:
+        search_results['next_cursor_mark'] = \
+            query.next_cursor_mark if not abort else data_dict['cursorMark']
+
     include_raw_solr_results = False
-    for item in plugins.PluginImplementations(plugins.IPackageController):
-        if 'include_raw_solr_results' in dir(item):
-            include_raw_solr_results = include_raw_solr_results \
-                                       or item.include_raw_solr_results(data_dict)
+    for item in search_capabilities().raw_solr_results_plugins:
+        include_raw_solr_results = include_raw_solr_results \
+                                   or item.include_raw_solr_results(data_dict)
 
     if include_raw_solr_results:
         search_results['raw_solr_results'] = raw_solr_results
@@ -333,11 +491,8 @@ def package_search(context, data_dict):
     for field_name in ('groups', 'organization'):
         group_names.extend(facets.get(field_name, {}).keys())
 
-    groups = (session.query(model.Group.name, model.Group.title)
-                    .filter(model.Group.name.in_(group_names))
-                    .all()
-              if group_names else [])
-    group_titles_by_name = dict(groups)
+    group_titles_by_name = group_titles(session, group_names)
+    licenses = licenses_by_id()
 
     # Transform facets into a more useful data structure.
     restructured_facets = {}
@@ -354,7 +509,7 @@ def package_search(context, data_dict):
                 display_name = display_name if display_name and display_name.strip() else key_
                 new_facet_dict['display_name'] = display_name
             elif key == 'license_id':
-                license = model.Package.get_license_register().get(key_)
+                license = licenses.get(key_)
                 if license:
                     new_facet_dict['display_name'] = license.title
                 else:
@@ -376,33 +531,225 @@ def package_search(context, data_dict):
             search_results['search_facets'][facet]['items'],
             key=lambda facet: facet['display_name'], reverse=True)
 
+    if cache_key is not None:
+        search_cache.set(cache_key, copy.deepcopy(search_results))
+
     return search_results
 
 
+def financial_year_packages(context, data_dict):
+    '''
+    Page through all the public datasets for a financial year, sorted by name.
+
+    Uses Solr cursors, so later pages are as fast as the first.
+
+    :param financial_year: e.g. 2017-18. Defaults to the latest financial year
+        with datasets.
+    :param cursor: ``next_cursor`` from the previous page, or ``*`` (the
+        default) for the first page.
+    :param rows: number of datasets per page (default 100, at most 1000)
+    :returns: dict with ``results``, ``count`` and ``next_cursor``. All
+        datasets have been returned when ``next_cursor`` equals ``cursor``.
+    '''
+    financial_year = data_dict.get('financial_year') or \
+        helpers.latest_financial_year()
+    cursor = data_dict.get('cursor') or '*'
+    try:
+        rows = int(data_dict.get('rows', 100))
+        if rows < 0:
+            raise ValueError(rows)
+    except (TypeError, ValueError):
+        raise ValidationError({'rows': [_('Must be a natural number')]})
+    search_results = tk.get_action('package_search')(context, {
+        'fq': 'vocab_financial_years:%s' % solr_literal(financial_year),
+        'rows': min(1000, rows),
+        'sort': 'name asc',
+        'cursorMark': cursor,
+    })
+    return {
+        'results': search_results['results'],
+        'count': search_results['count'],
+        'next_cursor': search_results['next_cursor_mark'],
+    }
+
+
+def search_stats(context, data_dict):
+    '''
+    How well this process's search cache and Solr connection pool are
+    working. Only available to sysadmins.
+
+    Each web process has its own cache and pool, so repeated calls may be
+    answered by different processes.
+
+    :returns: dict with ``search_cache``, the cache's ``hits``, ``misses``,
+        ``size`` and ``max_size``, and ``solr_connections``, the
+        ``connections`` opened, ``requests`` made and connections ``idle``
+        per Solr host
+    '''
+    _check_access('sysadmin', context, data_dict)
+    return {
+        'search_cache': search_cache.stats(),
+        'solr_connections': pool_stats(),
+    }
+
+
+def facet_counts(context, data_dict):
+    '''
+    Count the datasets matching a search by the values of some fields,
+    without fetching the datasets.
+
+    A lean alternative to package_search with ``rows=0``: a single Solr query
+    and none of package_search's processing of results and facets.
+
+    :param facet.field: the fields to count, as a list or JSON-encoded list
+    :param q: search query (default all datasets)
+    :param fq: filter query
+    :param facet.limit: most values to return per field; -1 for all.
+        Defaults to all values of controlled vocabularies, and otherwise
+        ``satreasury.facet_limits`` or ``search.facets.limit`` (50)
+    :param facet.mincount: least datasets for a value to be returned
+        (default 1)
+    :param include_private: also count private datasets the user may see
+        (default False)
+    :returns: dict with ``count``, the number of matching datasets, and
+        ``facets``, a dict of field name to a dict of value to count
+    '''
+    _check_access('package_search', context, data_dict)
+
+    fields = data_dict.get('facet.field') or []
+    if isinstance(fields, six.string_types):
+        try:
+            fields = json.loads(fields)
+        except ValueError:
+            fields = None
+    if not isinstance(fields, list):
+        raise ValidationError({'facet.field': [_('Must be a list of fields')]})
+
+    query = {'rows': 0, 'fl': 'id', 'facet.field': fields}
+    for key in ('q', 'fq', 'facet.limit', 'facet.mincount'):
+        if data_dict.get(key) not in (None, ''):
+            query[key] = data_dict[key]
+    if not asbool(data_dict.get('include_private', False)):
+        query['fq_list'] = ['+capacity:public']
+
+    user = context.get('user')
+    if context.get('ignore_auth') or (user and authz.is_sysadmin(user)):
+        labels = None
+    else:
+        labels = lib_plugins.get_permission_labels(
+            ).get_user_dataset_labels(context['auth_user_obj'])
+
+    search_query = PackageSearchQuery()
+    search_query.run(query, permission_labels=labels)
+    return {
+        'count': search_query.count,
+        'facets': search_query.facets,
+    }
+
+
 HIGHLIGHTING_PARAMETERS = ['hl', 'hl.fl', 'hl.snippets', 'hl.fragsize',
-                           'hl.simple.pre', 'hl.simple.post', 'pf']
+                           'hl.simple.pre', 'hl.simple.post', 'pf',
+                           'hl.maxAnalyzedChars', 'hl.method',
+                           'hl.offsetSource']
+
+# Highlighting every stored field with hl.fl=* analyzes all the extracted
+# fulltext of every result, so only these fields are highlighted.
+HIGHLIGHT_FIELDS = config.get(
+    'satreasury.highlight_fields',
+    'title notes ckanext-extractor_*_fulltext').replace(',', ' ').split()
+HIGHLIGHT_MAX_ANALYZED_CHARS = int(config.get(
+    'satreasury.highlight_max_analyzed_chars', 51200))
+# e.g. unified, which with hl.offsetSource can use offsets stored in the
+# index instead of analyzing the text again. Solr's default if not set.
+HIGHLIGHT_METHOD = config.get('satreasury.highlight_method')
+HIGHLIGHT_OFFSET_SOURCE = config.get('satreasury.highlight_offset_source')
+HIGHLIGHT_SNIPPETS = 5
+HIGHLIGHT_MAX_SNIPPETS = int(config.get('satreasury.highlight_max_snippets', 10))
+HIGHLIGHT_FRAGSIZE = 200
+HIGHLIGHT_MAX_FRAGSIZE = int(config.get('satreasury.highlight_max_fragsize', 1000))
+
+
+def bounded_int(value, default, maximum):
+    '''
+    value as an int between 1 and maximum, or default if it isn't an int.
+    '''
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(value, maximum))
+
+CURSOR_PARAMETERS = ['cursorMark']
 
 
 class SATreasurySearchPlugin(plugins.SingletonPlugin):
 
     plugins.implements(plugins.IPackageController, inherit=True)
     plugins.implements(plugins.IActions)
+    plugins.implements(plugins.IDomainObjectModification, inherit=True)
+    plugins.implements(plugins.IPluginObserver, inherit=True)
+    plugins.implements(plugins.IGroupController, inherit=True)
+    plugins.implements(plugins.IOrganizationController, inherit=True)
+
+    # IPluginObserver
+    def after_load(self, service):
+        reset_search_capabilities()
+
+    def after_unload(self, service):
+        reset_search_capabilities()
+
+    # IDomainObjectModification
+    def notify(self, entity, operation):
+        search_cache.clear()
+
+    # IGroupController and IOrganizationController, which share these hooks
+    # with IPackageController. IDomainObjectModification isn't notified of
+    # group changes.
+    def create(self, entity):
+        self.entity_changed(entity)
+
+    def edit(self, entity):
+        self.entity_changed(entity)
+
+    def delete(self, entity):
+        self.entity_changed(entity)
+
+    def entity_changed(self, entity):
+        if isinstance(entity, model.Group):
+            facet_title_cache.clear()
+            search_cache.clear()
 
     def get_actions(self):
         package_search.side_effect_free = True
+        financial_year_packages.side_effect_free = True
+        facet_counts.side_effect_free = True
+        search_stats.side_effect_free = True
         return {
             'package_search': package_search,
+            'financial_year_packages': financial_year_packages,
+            'facet_counts': facet_counts,
+            'search_stats': search_stats,
         }
 
     def before_search(self, search_params):
         # log.info("before_search %r", search_params)
         if asbool(search_params.get('extras').get('ext_highlight')):
+            extras = search_params['extras']
             search_params['hl'] = 'on'
-            search_params['hl.fl'] = '*'
+            search_params['hl.fl'] = ' '.join(HIGHLIGHT_FIELDS)
+            search_params['hl.maxAnalyzedChars'] = HIGHLIGHT_MAX_ANALYZED_CHARS
+            if HIGHLIGHT_METHOD:
+                search_params['hl.method'] = HIGHLIGHT_METHOD
+            if HIGHLIGHT_OFFSET_SOURCE:
+                search_params['hl.offsetSource'] = HIGHLIGHT_OFFSET_SOURCE
             search_params['hl.simple.pre'] = ''
             search_params['hl.simple.post'] = ''
-            search_params['hl.snippets'] = 5
-            search_params['hl.fragsize'] = 200
+            search_params['hl.snippets'] = bounded_int(
+                extras.get('ext_highlight_snippets'), HIGHLIGHT_SNIPPETS,
+                HIGHLIGHT_MAX_SNIPPETS)
+            search_params['hl.fragsize'] = bounded_int(
+                extras.get('ext_highlight_fragsize'), HIGHLIGHT_FRAGSIZE,
+                HIGHLIGHT_MAX_FRAGSIZE)
             # Make sure that matches where the query words are in close
             # proximity get higher ranking
             search_params['pf'] = ['name^4 title^4 tags^2 groups^2 text']
@@ -419,7 +766,7 @@ class SATreasurySearchPlugin(plugins.SingletonPlugin):
         """
         Takes a set and returns a set
         """
-        for param in HIGHLIGHTING_PARAMETERS:
+        for param in HIGHLIGHTING_PARAMETERS + CURSOR_PARAMETERS:
             valid_solr_parameters.add(param)
         return valid_solr_parameters
 
@@ -440,30 +787,88 @@ class SATreasurySearchPlugin(plugins.SingletonPlugin):
             # Clean up the stuff we needed for assigning highlighting
             del search_results['raw_solr_results']
 
+        fields = search_params.get('extras').get('ext_fields')
+        if fields:
+            projection = parse_fields(fields)
+            if asbool(search_params.get('extras').get('ext_highlight')):
+                keep_highlighting(projection)
+            search_results['results'] = [
+                project(package_dict, projection)
+                for package_dict in search_results['results']]
+
         return search_results
 
 
+def parse_fields(fields):
+    '''
+    Parse an ext_fields value like ``name,title,resources.url`` into a dict
+    of the keys to keep from each package. The value is None to keep the
+    whole value, or the set of keys to keep from each of its dicts.
+    '''
+    projection = {}
+    for field in fields.split(','):
+        key, _, subkey = field.strip().partition('.')
+        if not key:
+            continue
+        if not subkey:
+            projection[key] = None
+        elif projection.get(key, ()) is not None:
+            projection.setdefault(key, set()).add(subkey)
+    return projection
+
+
+def keep_highlighting(projection):
+    projection['highlighting'] = None
+    for subkeys in projection.values():
+        if subkeys is not None:
+            subkeys.add('highlighting')
+
+
+def project(package_dict, projection):
+    '''
+    The parts of a package dict selected by a parse_fields projection.
+    '''
+    projected = {}
+    for key, subkeys in projection.items():
+        if key not in package_dict:
+            continue
+        value = package_dict[key]
+        if subkeys is not None:
+            if isinstance(value, list):
+                value = [_project_dict(item, subkeys) for item in value]
+            else:
+                value = _project_dict(value, subkeys)
+        projected[key] = value
+    return projected
+
+
+def _project_dict(value, keys):
+    if not isinstance(value, dict):
+        return value
+    return dict((k, v) for k, v in value.items() if k in keys)
+
+
 RESOURCE_RE = re.compile('^ckanext-extractor_([a-z0-9_-]+)_fulltext$')
 
 
 def assign_highlighting(result_packages, solr_results, highlighting):
-    for idx, solr_result in enumerate(solr_results):
+    for package_result, solr_result in zip(result_packages, solr_results):
 
         index_id = solr_result['index_id']
         package_highlighting = highlighting[index_id]
-        package_result = result_packages[idx]
         package_result['highlighting'] = package_highlighting
 
         # Initialise resource highlighting key
+        resources_by_id = {}
         for resource in package_result['resources']:
             resource['highlighting'] = {}
+            resources_by_id[resource['id']] = resource
 
         # Move resource highlighting to the resource
         for key in package_highlighting.keys():
             match = RESOURCE_RE.match(key)
             if match:
-                resource_id = match.group(1)
                 highlights = package_highlighting.pop(key)
-                for resource in package_result['resources']:
-                    if resource['id'] == resource_id:
-                        resource['highlighting']['fulltext'] = highlights
+                resource = resources_by_id.get(match.group(1))
+                if resource is not None:
+                    resource['highlighting']['fulltext'] = highlights
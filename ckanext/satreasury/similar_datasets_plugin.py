@@ -1,23 +1,51 @@
 """
 Based on
 https://github.com/stadt-karlsruhe/ckanext-discovery/blob/master/ckanext/discovery/plugins/similar_datasets/__init__.py
+
+MoreLikeThis queries are expensive and their answers rarely change, so the
+ids of each dataset's similar datasets are kept in the shared cache backend.
+A background job refreshes them for datasets that change, and the
+``satreasury refresh-similar-datasets`` command refreshes all of them.
 """
 
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import logging
-import json
 
+import redis
+import sqlalchemy
+
+import ckan.lib.jobs as jobs
+import ckan.model as model
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as tk
-from ckan.lib.search.common import make_connection
+from ckan.lib.search.query import solr_literal
+from ckanext.satreasury import decoding
+from ckanext.satreasury.cache import get_shared_backend
+from ckanext.satreasury.solr import make_connection
 from ckan.common import config
 
 
 log = logging.getLogger(__name__)
 
 MAX_NUM = 5
+SIMILAR_KEY = 'similar_datasets:%s'
+# Entries also expire so that datasets created since are eventually found
+# without a full refresh
+SIMILAR_DATASETS_TTL = int(config.get('satreasury.similar_datasets_ttl',
+                                      7 * 24 * 60 * 60))
+
+
+def similar_filters():
+    return [
+        'site_id:%s' % solr_literal(config.get('ckan.site_id')),
+        'dataset_type:dataset',
+        'state:active',
+        'capacity:public',
+        '-organization:national-treasury',
+    ]
+
 
 def get_similar_datasets(context, data_dict):
     '''
@@ -25,37 +53,126 @@ def get_similar_datasets(context, data_dict):
     :param string id: ID or nameof the target dataset.
     :return: A list of similar dataset dicts sorted by decreasing score.
     '''
-    id_or_name = data_dict['id']
-    package = tk.get_action('package_show')({'ignore_auth': True}, {'id': id_or_name})
-    id = package['id']
+    id = resolve_package_id(data_dict['id'])
     solr = make_connection()
+    backend = get_shared_backend()
+    try:
+        similar_ids = backend.get(SIMILAR_KEY % id)
+    except redis.exceptions.RedisError:
+        log.exception('Could not look up similar datasets of %s', id)
+        similar_ids = None
+    if similar_ids is not None:
+        return fetch_datasets(solr, similar_ids)
+
+    docs = query_similar(solr, id, 'id validated_data_dict score')
+    try:
+        backend.set(SIMILAR_KEY % id, [doc['id'] for doc in docs],
+                    ttl=SIMILAR_DATASETS_TTL)
+    except redis.exceptions.RedisError:
+        log.exception('Could not store similar datasets of %s', id)
+    return [decoding.loads(doc['validated_data_dict']) for doc in docs]
+
+
+def resolve_package_id(id_or_name):
+    ''' The id of the dataset with this id or, failing that, name, without
+    loading the dataset.
+
+    Raises ObjectNotFound if there isn't one.
+    '''
+    row = (model.Session.query(model.Package.id)
+           .filter(sqlalchemy.or_(model.Package.id == id_or_name,
+                                  model.Package.name == id_or_name))
+           .order_by(sqlalchemy.desc(model.Package.id == id_or_name))
+           .first())
+    if row is None:
+        raise tk.ObjectNotFound('Dataset not found')
+    return row[0]
+
+
+def query_similar(solr, id, fields_to_return):
+    ''' Run a MoreLikeThis query for the datasets most similar to a dataset.
+    '''
     query = 'id:"{}"'.format(id)
     fields_to_compare = 'text'
-    fields_to_return = 'id validated_data_dict score'
-    site_id = config.get('ckan.site_id')
-    filter_query = '''
-        +site_id:"{}"
-        +dataset_type:dataset
-        +state:active
-        +capacity:public
-        -organization:national-treasury
-        '''.format(site_id)
     results = solr.more_like_this(q=query,
                                   mltfl=fields_to_compare,
                                   fl=fields_to_return,
-                                  fq=filter_query,
+                                  fq=similar_filters(),
                                   rows=MAX_NUM)
     log.debug('Similar datasets for {}:'.format(id))
-    print('Similar datasets for {}:'.format(id))
     for doc in results.docs:
         log.debug('  {id} (score {score})'.format(**doc))
-    return [json.loads(doc['validated_data_dict']) for doc in results.docs]
+    return results.docs
+
+
+def fetch_datasets(solr, ids):
+    ''' Dataset dicts for ids, in the same order, leaving out any that are no
+    longer public.
+    '''
+    if not ids:
+        return []
+    filters = similar_filters() + [
+        'id:(%s)' % ' OR '.join(solr_literal(id) for id in ids)]
+    results = solr.search(q='*:*', fq=filters, fl='id validated_data_dict',
+                          rows=len(ids))
+    docs = dict((doc['id'], doc) for doc in results.docs)
+    return [decoding.loads(docs[id]['validated_data_dict'])
+            for id in ids if id in docs]
+
+
+def iter_public_dataset_ids(solr, page_size=1000):
+    cursor = '*'
+    while True:
+        results = solr.search(q='*:*', fq=similar_filters(), fl='id',
+                              sort='index_id asc', rows=page_size,
+                              cursorMark=cursor)
+        for doc in results.docs:
+            yield doc['id']
+        if not results.docs or results.nextCursorMark == cursor:
+            return
+        cursor = results.nextCursorMark
+
+
+def refresh_similar_datasets(ids=None):
+    ''' Work out and store the similar datasets of each of ids, by default
+    every public dataset. Returns how many datasets were refreshed.
+    '''
+    solr = make_connection()
+    backend = get_shared_backend()
+    if ids is None:
+        ids = iter_public_dataset_ids(solr)
+    count = 0
+    for id in ids:
+        similar_ids = [doc['id'] for doc in query_similar(solr, id, 'id score')]
+        backend.set(SIMILAR_KEY % id, similar_ids, ttl=SIMILAR_DATASETS_TTL)
+        count += 1
+    log.info('Refreshed similar datasets of %d datasets', count)
+    return count
+
+
+def enqueue_refresh(ids):
+    return jobs.enqueue(refresh_similar_datasets, [ids],
+                        title='Refresh similar datasets')
 
 
 class SimilarDatasetsPlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IActions)
+    plugins.implements(plugins.IDomainObjectModification, inherit=True)
 
     def get_actions(self):
         return {
             'similar_datasets': get_similar_datasets,
         }
+
+    # IDomainObjectModification
+    def notify(self, entity, operation):
+        if not isinstance(entity, model.Package):
+            return
+        try:
+            if entity.state == 'active' and not entity.private:
+                enqueue_refresh([entity.id])
+            else:
+                get_shared_backend().delete(SIMILAR_KEY % entity.id)
+        except redis.exceptions.RedisError:
+            log.exception('Could not refresh similar datasets of %s',
+                          entity.id)
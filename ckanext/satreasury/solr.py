@@ -0,0 +1,98 @@
+"""
+Solr connections shared by package searches and similar dataset queries.
+
+CKAN's make_connection creates a new pysolr connection, with its own requests
+session, on every call, so connections to Solr are never kept alive between
+queries. Connections made here share one session per process whose connection
+pool keeps them alive and reuses them.
+"""
+
+import logging
+import threading
+
+import pysolr
+import requests
+import simplejson
+from requests.adapters import HTTPAdapter
+
+from ckan.common import config
+from ckan.lib.search.common import SolrSettings, solr_datetime_decoder
+
+SOLR_TIMEOUT = (
+    float(config.get('satreasury.solr_connect_timeout', 5)),
+    float(config.get('satreasury.solr_read_timeout', 60)),
+)
+# Connections kept alive to Solr per process. More threads than this can
+# still query Solr at once, but the extra connections are closed afterwards.
+SOLR_POOL_MAXSIZE = int(config.get('satreasury.solr_pool_maxsize', 10))
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_session = None
+_connections = {}
+
+
+def make_session(pool_maxsize=SOLR_POOL_MAXSIZE):
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.stream = False
+    return session
+
+
+def get_session():
+    """ Module-wide session so connections to Solr are kept alive and reused.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+def make_connection(decode_dates=True):
+    """ Drop-in replacement for CKAN's make_connection returning a pysolr
+    connection that uses the shared session.
+    """
+    solr_url, solr_user, solr_password = SolrSettings.get()
+    session = get_session()
+    with _lock:
+        conn = _connections.get((solr_url, decode_dates))
+        if conn is None:
+            if decode_dates:
+                decoder = simplejson.JSONDecoder(
+                    object_hook=solr_datetime_decoder)
+            else:
+                decoder = None
+            conn = pysolr.Solr(solr_url, decoder=decoder, timeout=SOLR_TIMEOUT)
+            conn.session = session
+            if solr_user is not None and solr_password is not None:
+                session.auth = (solr_user, solr_password)
+            _connections[(solr_url, decode_dates)] = conn
+        return conn
+
+
+def pool_stats():
+    """ Connections opened, requests made and connections currently idle in
+    the pool per Solr host, since the process started.
+    """
+    stats = {}
+    if _session is None:
+        return stats
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # The pool's queue is padded with None up to its maximum size
+            idle = len([c for c in list(pool.pool.queue) if c is not None]) \
+                if pool.pool else 0
+            stats['%s://%s:%s' % (pool.scheme, pool.host, pool.port)] = {
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': idle,
+            }
+    return stats
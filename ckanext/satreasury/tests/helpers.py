@@ -0,0 +1,112 @@
+"""
+Stand-ins shared by the tests.
+"""
+
+import json
+import threading
+import time
+import unittest
+import warnings
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import ckan.model as model
+import sqlalchemy
+from mock import patch
+
+
+class FakeClock(object):
+    """ Clock to pass in place of ``time.time`` (and ``time.sleep``) so
+    expiry can be tested without waiting.
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class StubJSONServer(ThreadingMixIn, HTTPServer):
+    """ Local stand-in for a JSON API (Travis, Solr) which replies to each
+    request with the next of a list of (status, body, delay) responses.
+    """
+    daemon_threads = True
+
+    def __init__(self, responses):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubJSONHandler)
+        self.responses = list(responses)
+        self.requests = []
+
+    def handle_error(self, request, client_address):
+        # Clients going away after timing out is expected
+        pass
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+
+class StubJSONHandler(BaseHTTPRequestHandler):
+    # Keep connections alive like the real APIs
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.command, self.path))
+        status, body, delay = self.server.responses.pop(0)
+        time.sleep(delay)
+        content = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server(test_case, responses):
+    """ Serve responses from a StubJSONServer in the background until
+    test_case is cleaned up.
+    """
+    server = StubJSONServer(responses)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    test_case.addCleanup(server.server_close)
+    test_case.addCleanup(server.shutdown)
+    return server
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """ Replaces the database session with one for an in-memory database with
+    just the CKAN ``tables`` the tests need.
+    """
+    tables = []
+
+    def setUp(self):
+        engine = sqlalchemy.create_engine('sqlite://')
+        for table in self.tables:
+            model.meta.metadata.tables[table].create(engine)
+        self.session = sqlalchemy.orm.scoped_session(
+            sqlalchemy.orm.sessionmaker(bind=engine))
+        self.addCleanup(self.session.remove)
+        p = patch.object(model, 'Session', self.session)
+        p.start()
+        self.addCleanup(p.stop)
+        # SQLite complains about str values for unicode columns
+        catch_warnings = warnings.catch_warnings()
+        catch_warnings.__enter__()
+        self.addCleanup(catch_warnings.__exit__)
+        warnings.simplefilter('ignore', sqlalchemy.exc.SAWarning)
@@ -0,0 +1,131 @@
+import unittest
+
+from ckanext.satreasury.cache import (LRUCache, MemoryBackend, RedisBackend,
+                                     TTLCache)
+from ckanext.satreasury.tests.helpers import FakeClock
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(ttl=60, clock=self.clock)
+
+    def test_get_or_set_computes_once_while_fresh(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return ['2017-18']
+
+        self.assertEqual(self.cache.get_or_set('years', compute), ['2017-18'])
+        self.clock.now += 59
+        self.assertEqual(self.cache.get_or_set('years', compute), ['2017-18'])
+        self.assertEqual(len(calls), 1)
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.set('years', ['2017-18'])
+        self.clock.now += 60
+        self.assertIsNone(self.cache.get('years'))
+
+    def test_invalidate_and_clear(self):
+        self.cache.set('provinces', ['Gauteng'])
+        self.cache.set('spheres', ['national'])
+        self.cache.invalidate('provinces')
+        self.assertIsNone(self.cache.get('provinces'))
+        self.assertEqual(self.cache.get('spheres'), ['national'])
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('spheres'))
+
+
+class FakeRedis(object):
+    """ Local stand-in for the parts of redis.StrictRedis we use. """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def get(self, name):
+        value, expires = self.data.get(name, (None, None))
+        if expires is not None and expires <= self.clock():
+            del self.data[name]
+            return None
+        return value
+
+    def set(self, name, value, ex=None, nx=False):
+        assert isinstance(value, str)
+        assert ex is None or isinstance(ex, int)
+        if nx and self.get(name) is not None:
+            return None
+        self.data[name] = (value, None if ex is None else self.clock() + ex)
+        return True
+
+    def delete(self, name):
+        self.data.pop(name, None)
+
+
+class SharedBackendTests(object):
+    def test_get_set_delete(self):
+        self.assertIsNone(self.backend.get('builds'))
+        self.assertEqual(self.backend.get('builds', []), [])
+        self.backend.set('builds', [{'id': 1}])
+        self.assertEqual(self.backend.get('builds'), [{'id': 1}])
+        self.backend.delete('builds')
+        self.assertIsNone(self.backend.get('builds'))
+
+    def test_ttl(self):
+        self.backend.set('builds', [], ttl=10)
+        self.clock.now += 9
+        self.assertEqual(self.backend.get('builds'), [])
+        self.clock.now += 1
+        self.assertIsNone(self.backend.get('builds'))
+
+    def test_add_only_sets_missing_keys(self):
+        self.assertTrue(self.backend.add('scheduled', 1, ttl=10))
+        self.assertFalse(self.backend.add('scheduled', 2, ttl=10))
+        self.assertEqual(self.backend.get('scheduled'), 1)
+        self.clock.now += 10
+        self.assertTrue(self.backend.add('scheduled', 3))
+
+
+class TestMemoryBackend(SharedBackendTests, unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.backend = MemoryBackend(clock=self.clock)
+
+
+class TestRedisBackend(SharedBackendTests, unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.redis = FakeRedis(self.clock)
+        self.backend = RedisBackend(self.redis, prefix='test:')
+
+    def test_keys_are_prefixed(self):
+        self.backend.set('builds', [])
+        self.assertEqual(list(self.redis.data.keys()), ['test:builds'])
+
+
+class TestLRUCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LRUCache(max_size=2, ttl=60, clock=self.clock)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.cache.set('c', 3)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_expiry_and_counters(self):
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.clock.now += 60
+        self.cache.get('a')
+        self.assertEqual(self.cache.stats(), {
+            'hits': 1,
+            'misses': 1,
+            'size': 0,
+            'max_size': 2,
+        })
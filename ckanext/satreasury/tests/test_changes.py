@@ -0,0 +1,117 @@
+import unittest
+
+from ckanext.satreasury import changes
+from ckanext.satreasury.cache import MemoryBackend
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+FY = Obj(id='fy', name='financial_years')
+
+
+def make_package(**kwargs):
+    fields = {
+        'id': 'pkg-1',
+        'name': 'eastern-cape-budget',
+        'title': 'Eastern Cape Budget',
+        'notes': 'Budget data',
+        'url': None,
+        'version': None,
+        'license_id': 'cc-by',
+        'owner_org': 'org-1',
+        'state': 'active',
+        'private': False,
+    }
+    fields.update(kwargs)
+    package = Obj(**fields)
+    package.extras = {'methodology': 'Counted', 'internal_note': 'x'}
+    package.package_tag_all = [
+        Obj(state='active', tag=Obj(vocabulary_id='fy', vocabulary=FY,
+                                    name='2018-19')),
+        Obj(state='deleted', tag=Obj(vocabulary_id='fy', vocabulary=FY,
+                                     name='2017-18')),
+        Obj(state='active', tag=Obj(vocabulary_id=None, vocabulary=None,
+                                    name='budget')),
+    ]
+    package.resources = [
+        Obj(id='res-1', name='Data', description='',
+            url='http://example.com/a.csv', format='CSV', position=0),
+    ]
+    return package
+
+
+class TestPublishedChange(unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend()
+
+    def test_first_save_of_published_package(self):
+        self.assertIsNotNone(
+            changes.published_change(make_package(), self.backend))
+
+    def test_save_without_edits(self):
+        changes.published_change(make_package(), self.backend)
+        self.assertIsNone(
+            changes.published_change(make_package(), self.backend))
+
+    def test_published_field_edited(self):
+        changes.published_change(make_package(), self.backend)
+        self.assertIsNotNone(changes.published_change(
+            make_package(title='Eastern Cape Budget 2018'), self.backend))
+
+    def test_unpublished_extras_ignored(self):
+        changes.published_change(make_package(), self.backend)
+        package = make_package()
+        package.extras = {'methodology': 'Counted', 'internal_note': 'y'}
+        self.assertIsNone(changes.published_change(package, self.backend))
+
+    def test_resource_edited(self):
+        changes.published_change(make_package(), self.backend)
+        package = make_package()
+        package.resources[0].url = 'http://example.com/b.csv'
+        self.assertIsNotNone(changes.published_change(package, self.backend))
+
+    def test_tag_removed(self):
+        changes.published_change(make_package(), self.backend)
+        package = make_package()
+        package.package_tag_all[0].state = 'deleted'
+        self.assertIsNotNone(changes.published_change(package, self.backend))
+
+    def test_private_package_edits(self):
+        self.assertIsNone(changes.published_change(
+            make_package(private=True), self.backend))
+        self.assertIsNone(changes.published_change(
+            make_package(private=True, title='Draft'), self.backend))
+
+    def test_made_private_and_public(self):
+        changes.published_change(make_package(), self.backend)
+        self.assertIsNotNone(changes.published_change(
+            make_package(private=True), self.backend))
+        self.assertIsNotNone(
+            changes.published_change(make_package(), self.backend))
+
+    def test_change_lists_pages_before_and_after(self):
+        changes.published_change(make_package(), self.backend)
+        package = make_package(owner_org='org-2')
+        package.package_tag_all[1].state = 'active'
+        self.assertEqual(changes.published_change(package, self.backend), {
+            'datasets': ['pkg-1'],
+            'organizations': ['org-1', 'org-2'],
+            'financial_years': ['2017-18', '2018-19'],
+        })
+
+    def test_unpublished_change_lists_previous_pages(self):
+        changes.published_change(make_package(), self.backend)
+        self.assertEqual(
+            changes.published_change(make_package(private=True), self.backend), {
+                'datasets': ['pkg-1'],
+                'organizations': ['org-1'],
+                'financial_years': ['2018-19'],
+            })
+
+    def test_deleted(self):
+        changes.published_change(make_package(), self.backend)
+        self.assertIsNotNone(changes.published_change(
+            make_package(state='deleted'), self.backend))
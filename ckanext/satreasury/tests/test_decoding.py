@@ -0,0 +1,53 @@
+import copy
+import json
+import unittest
+
+import simplejson
+from ckanext.satreasury import decoding
+from ckanext.satreasury.decoding import LazyPackageDict, decode_package
+from mock import patch
+
+PACKAGE = {
+    'name': 'eastern-cape-budget',
+    'amount': 1.1,
+    'big': 2 ** 70,
+    'resources': [{'url': u'http://example.com/\xe9.csv'}],
+}
+
+
+class TestDecodePackage(unittest.TestCase):
+    def test_decodes_eagerly_by_default(self):
+        self.assertEqual(decode_package(json.dumps(PACKAGE)), PACKAGE)
+
+    def test_decodes_with_standard_library_results(self):
+        encoded = json.dumps(PACKAGE)
+        self.assertEqual(decoding.loads(encoded), json.loads(encoded))
+
+
+class TestLazyPackageDict(unittest.TestCase):
+    def test_only_decoded_on_first_access(self):
+        with patch.object(decoding, 'loads', wraps=decoding.loads) as loads:
+            package = decode_package(json.dumps(PACKAGE), lazy=True)
+            self.assertEqual(loads.call_count, 0)
+
+            self.assertEqual(package['name'], 'eastern-cape-budget')
+            self.assertEqual(package.get('missing'), None)
+            self.assertEqual(len(package), 4)
+            self.assertEqual(loads.call_count, 1)
+
+    def test_behaves_as_a_dict(self):
+        package = LazyPackageDict(json.dumps(PACKAGE))
+        package['highlighting'] = {}
+        del package['big']
+        expected = dict(PACKAGE, highlighting={})
+        del expected['big']
+
+        self.assertEqual(package, expected)
+        self.assertEqual(dict(package), expected)
+        self.assertEqual(dict(copy.deepcopy(package)), expected)
+
+    def test_encoded_like_a_dict_by_ckan_api(self):
+        package = LazyPackageDict(json.dumps(PACKAGE))
+        self.assertEqual(
+            json.loads(simplejson.dumps({'results': [package]}, for_json=True)),
+            json.loads(json.dumps({'results': [PACKAGE]})))
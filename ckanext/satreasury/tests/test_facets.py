@@ -0,0 +1,21 @@
+import unittest
+
+from ckanext.satreasury import facets
+
+
+class TestFacetOptions(unittest.TestCase):
+    def test_parse_facet_limits(self):
+        self.assertEqual(facets.parse_facet_limits(' res_format:20  groups:10 '),
+                         {'res_format': 20, 'groups': 10})
+        self.assertEqual(facets.parse_facet_limits(''), {})
+        with self.assertRaises(ValueError):
+            facets.parse_facet_limits('res_format')
+
+    def test_vocabularies_are_counted_in_full(self):
+        options = facets.make_field_options({'vocab_provinces': 5,
+                                             'res_format': 20})
+        self.assertEqual(options['vocab_financial_years'],
+                         {'facet.method': 'enum', 'facet.limit': -1})
+        self.assertEqual(options['vocab_provinces'],
+                         {'facet.method': 'enum', 'facet.limit': 5})
+        self.assertEqual(options['res_format'], {'facet.limit': 20})
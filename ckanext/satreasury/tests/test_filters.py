@@ -0,0 +1,39 @@
+import unittest
+
+from ckanext.satreasury.filters import canonical_filters, split_filter
+
+
+class TestSplitFilter(unittest.TestCase):
+    def test_splits_top_level_clauses(self):
+        self.assertEqual(
+            split_filter('+capacity:public  vocab_financial_years:"2017-18" '
+                         '-organization:national-treasury'),
+            ['capacity:public', 'vocab_financial_years:"2017-18"',
+             '-organization:national-treasury'])
+
+    def test_keeps_groups_quotes_ranges_and_escapes_together(self):
+        self.assertEqual(
+            split_filter('+state:(active OR draft) title:"Eastern Cape" '
+                         'metadata_modified:[NOW-1DAY TO *} name:a\\ b'),
+            ['state:(active OR draft)', 'title:"Eastern Cape"',
+             'metadata_modified:[NOW-1DAY TO *}', 'name:a\\ b'])
+
+    def test_keeps_filters_that_are_not_conjunctions_whole(self):
+        for fq in ['organization:a OR organization:b',
+                   'NOT organization:a',
+                   '{!tag=org}organization:a',
+                   'organization: a',
+                   'title:"unbalanced',
+                   'state:(active']:
+            self.assertEqual(split_filter(fq), [fq])
+
+    def test_empty_filter(self):
+        self.assertEqual(split_filter('  '), [])
+
+
+class TestCanonicalFilters(unittest.TestCase):
+    def test_sorted_and_deduplicated(self):
+        self.assertEqual(
+            canonical_filters(['+capacity:public organization:a',
+                               'capacity:public', '+organization:a']),
+            ['capacity:public', 'organization:a'])
@@ -0,0 +1,59 @@
+import shutil
+import tempfile
+import unittest
+
+from ckanext.satreasury import manifest
+from ckanext.satreasury.tests.helpers import FakeClock
+
+
+class TestRebuildManifest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = tmp_dir + '/manifest.json'
+        self.clock = FakeClock()
+        self.manifest = manifest.RebuildManifest(self.path, clock=self.clock)
+
+    def test_empty(self):
+        snapshot = self.manifest.read()
+        self.assertTrue(manifest.is_empty(snapshot))
+        self.assertEqual(manifest.build_env(snapshot, limit=10), {})
+
+    def test_changes_accumulate_until_removed(self):
+        self.manifest.record({
+            'datasets': ['pkg-1'],
+            'organizations': ['org-1'],
+            'financial_years': ['2018-19'],
+        })
+        self.manifest.record({
+            'datasets': ['pkg-2'],
+            'organizations': ['org-1'],
+            'financial_years': ['2017-18', '2018-19'],
+        })
+        snapshot = manifest.RebuildManifest(self.path).read()
+        self.assertEqual(manifest.build_env(snapshot, limit=10), {
+            'REBUILD_MODE': 'incremental',
+            'CHANGED_DATASETS': 'pkg-1,pkg-2',
+            'CHANGED_ORGANIZATIONS': 'org-1',
+            'CHANGED_FINANCIAL_YEARS': '2017-18,2018-19',
+        })
+
+        self.manifest.remove(snapshot)
+        self.assertTrue(manifest.is_empty(self.manifest.read()))
+
+    def test_changes_recorded_after_read_are_kept(self):
+        self.manifest.record({'datasets': ['pkg-1', 'pkg-2']})
+        snapshot = self.manifest.read()
+        self.clock.now += 1
+        self.manifest.record({'datasets': ['pkg-2']})
+        self.manifest.remove(snapshot)
+        self.assertEqual(list(self.manifest.read()['datasets']), ['pkg-2'])
+
+    def test_too_many_changes_rebuild_everything(self):
+        self.manifest.record({'datasets': ['pkg-%d' % i for i in range(11)]})
+        self.assertEqual(manifest.build_env(self.manifest.read(), limit=10), {})
+
+    def test_corrupt_file_is_ignored(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+        self.assertTrue(manifest.is_empty(self.manifest.read()))
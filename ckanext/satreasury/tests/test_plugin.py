@@ -1,19 +1,18 @@
-import json
 import unittest
-from functools import partial
 
 import ckan.model as model
-import responses
+import redis
+import sqlalchemy
+from ckanext.satreasury import cache, plugin
+from ckanext.satreasury.cache import MemoryBackend, TTLCache
 from ckanext.satreasury.plugin import SATreasuryDatasetPlugin
-from mock import MagicMock, Mock, PropertyMock, patch
+from ckanext.satreasury.tests.helpers import DatabaseTestCase, FakeClock
+from mock import Mock, PropertyMock, patch
 
-TRAVIS_ENDPOINT = "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal"
-TRAVIS_COMMIT_MESSAGE = 'Rebuild with new/modified dataset'
 TRAVIS_WEB_URL = "https://travis-ci.org/vulekamali/static-budget-portal/builds/"
 
 
 class TestNotifyMethod(unittest.TestCase):
-    @responses.activate
     def setUp(self):
         self.entity = Mock(spec=model.Package)
         self.entity.owner_org = PropertyMock(return_value=True)
@@ -22,133 +21,238 @@ class TestNotifyMethod(unittest.TestCase):
         flash_success_patch = patch(
             'ckanext.satreasury.plugin.ckan_helpers.flash_success')
         self.flash_success_mock = flash_success_patch.start()
+        self.addCleanup(flash_success_patch.stop)
         flash_error_patch = patch(
             'ckanext.satreasury.plugin.ckan_helpers.flash_error')
         self.flash_error_mock = flash_error_patch.start()
-        self.addCleanup(flash_success_patch.stop)
+        self.addCleanup(flash_error_patch.stop)
+        request_rebuild_patch = patch(
+            'ckanext.satreasury.plugin.rebuild.request_rebuild')
+        self.request_rebuild_mock = request_rebuild_patch.start()
+        self.addCleanup(request_rebuild_patch.stop)
+        published_change_patch = patch(
+            'ckanext.satreasury.plugin.changes.published_change',
+            return_value={'datasets': ['pkg-1']})
+        self.published_change_mock = published_change_patch.start()
+        self.addCleanup(published_change_patch.stop)
+        get_manifest_patch = patch(
+            'ckanext.satreasury.plugin.manifest.get_manifest')
+        self.get_manifest_mock = get_manifest_patch.start()
+        self.addCleanup(get_manifest_patch.stop)
+        rebuild_pending_patch = patch(
+            'ckanext.satreasury.plugin.rebuild.rebuild_pending',
+            return_value=False)
+        self.rebuild_pending_mock = rebuild_pending_patch.start()
+        self.addCleanup(rebuild_pending_patch.stop)
 
     @patch(
         'ckanext.satreasury.plugin.travis.build_trigger_enabled',
         return_value=True)
-    def test_notify_already_building(self, build_trigger_enabled_mock):
-        with responses.RequestsMock() as rsps:
-            rsps.add(
-                responses.GET,
-                "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/builds",
-                json={
-                    'builds': [
-                        {
-                            'id': 535878234,
-                            'commit': {
-                                'message': TRAVIS_COMMIT_MESSAGE
-                            },
-                        }]},
-                status=200,
-                content_type='application/json')
-            self.plugin.notify(self.entity, None)
-            message = "vulekamali will be updated in less than an hour. <a href='https://travis-ci.org/vulekamali/static-budget-portal/builds/535878234' >Check progress of the update process.</a>"
-            self.flash_success_mock.assert_called_with(
-                message, allow_html=True)
+    def test_notify_rebuild_requested(self, build_trigger_enabled_mock):
+        self.plugin.notify(self.entity, None)
+        self.assertEqual(self.request_rebuild_mock.call_count, 1)
+        self.get_manifest_mock.return_value.record.assert_called_with(
+            {'datasets': ['pkg-1']})
+        message = "vulekamali will be updated in less than an hour. <a href='%s' >Check progress of the update process.</a>" % TRAVIS_WEB_URL
+        self.flash_success_mock.assert_called_with(
+            message, allow_html=True)
 
     @patch(
         'ckanext.satreasury.plugin.travis.build_trigger_enabled',
         return_value=True)
-    def test_notify_build_triggered(self, build_trigger_enabled_mock):
-        with responses.RequestsMock() as rsps:
-            rsps.add(
-                responses.GET,
-                "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/builds",
-                json={
-                    'builds': []},
-                status=200,
-                content_type='application/json')
-            rsps.add(
-                responses.POST,
-                "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/requests",
-                json={
-                    'request': {
-                        'id': 12345}},
-                status=200,
-                content_type='application/json')
-            rsps.add(
-                responses.GET,
-                "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/request/12345",
-                json={
-                    'builds': [
-                        {
-                            'commit': {
-                                'message': TRAVIS_COMMIT_MESSAGE},
-                            'id': 535878234,
-                        }]},
-                status=200,
-                content_type='application/json')
-
-            self.plugin.notify(self.entity, None)
-            message = "vulekamali will be updated in less than an hour. <a href='https://travis-ci.org/vulekamali/static-budget-portal/builds/535878234' >Check progress of the update process.</a>"
-            self.flash_success_mock.assert_called_with(
-                message, allow_html=True)
+    @patch('ckanext.satreasury.plugin.ckan_helpers.flash_notice')
+    def test_notify_travis_unavailable(self, flash_notice_mock,
+                                       build_trigger_enabled_mock):
+        self.rebuild_pending_mock.return_value = True
+        self.plugin.notify(self.entity, None)
+        self.assertEqual(self.request_rebuild_mock.call_count, 1)
+        self.assertEqual(flash_notice_mock.call_count, 1)
+        self.assertFalse(self.flash_success_mock.called)
 
     @patch(
         'ckanext.satreasury.plugin.travis.build_trigger_enabled',
         return_value=True)
-    def test_notify_build_request_but_no_build(self, build_trigger_enabled_mock):
-        with responses.RequestsMock() as rsps:
-            rsps.add(
-                responses.GET,
-                "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/builds",
-                json={
-                    'builds': []},
-                status=200,
-                content_type='application/json')
-            rsps.add(
-                responses.POST,
-                "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/requests",
-                json={
-                    'request': {
-                        'id': 12345}},
-                status=200,
-                content_type='application/json')
-            rsps.add(
-                responses.GET,
-                "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/request/12345",
-                json={
-                    'builds': []},
-                status=200,
-                content_type='application/json')
-
-            self.plugin.notify(self.entity, None)
-            message = "vulekamali will be updated in less than an hour. <a href='https://travis-ci.org/vulekamali/static-budget-portal/builds/' >Check progress of the update process.</a>"
-            self.flash_success_mock.assert_called_with(
-                message, allow_html=True)
+    def test_notify_rebuild_request_errored(self, build_trigger_enabled_mock):
+        self.request_rebuild_mock.side_effect = redis.exceptions.ConnectionError(
+            'Connection refused')
+        self.plugin.notify(self.entity, None)
+        message = 'An error occurred when updating the static site data. Technical details: Connection refused'
+        self.flash_error_mock.assert_called_with(message)
+        self.assertFalse(self.flash_success_mock.called)
 
     @patch(
         'ckanext.satreasury.plugin.travis.build_trigger_enabled',
         return_value=True)
-    def test_notify_build_trigger_errored(self, build_trigger_enabled_mock):
-        with responses.RequestsMock() as rsps:
-            rsps.add(
-                responses.GET,
-                "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/builds",
-                json={
-                    'builds': []},
-                status=200,
-                content_type='application/json')
-            rsps.add(
-                responses.POST,
-                "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/requests",
-                json={
-                    'request': {
-                        'id': 12345}},
-                status=500,
-                content_type='application/json')
-
-            self.plugin.notify(self.entity, None)
-            message = 'An error occurred when updating the static site data. Technical details: 500 Server Error: Internal Server Error for url: https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal/requests'
-            self.flash_error_mock.assert_called_with(message)
+    def test_notify_nothing_published_changed(self, build_trigger_enabled_mock):
+        self.published_change_mock.return_value = None
+        self.plugin.notify(self.entity, None)
+        self.assertFalse(self.request_rebuild_mock.called)
 
     @patch(
         'ckanext.satreasury.plugin.travis.build_trigger_enabled',
         return_value=False)
     def test_notify_build_not_enabled(self, build_trigger_enabled_mock):
         self.plugin.notify(self.entity, None)
-        self.assertTrue(True)
+        self.assertFalse(self.request_rebuild_mock.called)
+
+
+class TestLoadVocabularies(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.backend = MemoryBackend()
+        for target, name, value in [
+                (cache, '_shared_backend', self.backend),
+                (plugin, 'vocabulary_cache',
+                 TTLCache(ttl=3600, clock=self.clock)),
+                (plugin, 'query_vocabulary_tags', Mock(return_value={
+                    'financial_years': ['2017-18'], 'provinces': []}))]:
+            p = patch.object(target, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_vocabularies_are_queried_once(self):
+        self.assertEqual(plugin.load_financial_years(), ['2017-18'])
+        self.assertEqual(plugin.load_provinces(), [])
+        self.assertEqual(plugin.query_vocabulary_tags.call_count, 1)
+
+    def test_missing_vocabulary_is_empty(self):
+        with patch.object(plugin, 'log') as log:
+            self.assertEqual(plugin.load_spheres(), [])
+        self.assertIn('bootstrap-vocabularies', log.warning.call_args[0][0])
+
+    def test_new_tags_are_loaded_once_expired(self):
+        plugin.load_financial_years()
+        plugin.query_vocabulary_tags.return_value = {
+            'financial_years': ['2017-18', '2018-19']}
+
+        self.clock.now += 3599
+        self.assertEqual(plugin.load_financial_years(), ['2017-18'])
+        self.clock.now += 1
+        self.assertEqual(plugin.load_financial_years(), ['2017-18', '2018-19'])
+        self.assertEqual(plugin.query_vocabulary_tags.call_count, 2)
+
+    def test_new_version_is_loaded_straight_away(self):
+        plugin.load_financial_years()
+        plugin.query_vocabulary_tags.return_value = {
+            'financial_years': ['2017-18', '2018-19']}
+
+        self.backend.set(plugin.VOCABULARY_VERSION_KEY, 1)
+        self.assertEqual(plugin.load_financial_years(), ['2017-18', '2018-19'])
+        self.assertEqual(plugin.load_financial_years(), ['2017-18', '2018-19'])
+        self.assertEqual(plugin.query_vocabulary_tags.call_count, 2)
+
+    def test_cached_while_version_unavailable(self):
+        plugin.load_financial_years()
+        with patch.object(self.backend, 'get',
+                          side_effect=redis.exceptions.ConnectionError()):
+            self.assertEqual(plugin.load_financial_years(), ['2017-18'])
+        self.assertEqual(plugin.query_vocabulary_tags.call_count, 1)
+
+
+class VocabularyDatabaseTestCase(DatabaseTestCase):
+    tables = ['vocabulary', 'tag']
+
+    def setUp(self):
+        super(VocabularyDatabaseTestCase, self).setUp()
+        self.backend = MemoryBackend()
+        p = patch.object(cache, '_shared_backend', self.backend)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def tag_names(self, vocab_name):
+        return sorted(tag.name for tag in self.session.query(model.Tag)
+                      .join(model.Vocabulary)
+                      .filter(model.Vocabulary.name == vocab_name))
+
+
+class TestBootstrapVocabularies(VocabularyDatabaseTestCase):
+    def test_creates_vocabularies_and_tags(self):
+        created = plugin.bootstrap_vocabularies()
+
+        required = plugin.required_vocabulary_tags()
+        self.assertEqual(created, sum(len(set(tags))
+                                      for tags in required.values()))
+        for vocab_name, tag_names in required.items():
+            self.assertEqual(self.tag_names(vocab_name), sorted(tag_names))
+
+    def test_only_missing_tags_are_created(self):
+        plugin.bootstrap_vocabularies()
+        version = self.backend.get(plugin.VOCABULARY_VERSION_KEY)
+        self.assertIsNotNone(version)
+        self.assertEqual(plugin.bootstrap_vocabularies(), 0)
+        self.assertEqual(self.backend.get(plugin.VOCABULARY_VERSION_KEY),
+                         version)
+
+        spheres = self.session.query(model.Vocabulary).filter_by(
+            name='spheres').one()
+        self.session.query(model.Tag).filter_by(
+            vocabulary_id=spheres.id, name='national').delete()
+        self.session.commit()
+        self.assertEqual(plugin.bootstrap_vocabularies(), 1)
+        self.assertEqual(self.tag_names('spheres'), ['national', 'provincial'])
+
+    def test_nothing_is_created_if_a_query_fails(self):
+        error = sqlalchemy.exc.OperationalError('INSERT', {}, None)
+        with patch.object(self.session, 'execute', side_effect=error):
+            with self.assertRaises(sqlalchemy.exc.SQLAlchemyError):
+                plugin.bootstrap_vocabularies()
+
+        self.assertEqual(self.session.query(model.Vocabulary).count(), 0)
+        self.assertEqual(self.session.query(model.Tag).count(), 0)
+
+
+class TestQueryVocabularyTags(VocabularyDatabaseTestCase):
+    def test_tag_names_by_vocabulary(self):
+        for vocab_name, tag_names in [('spheres', ['provincial', 'national']),
+                                      ('provinces', []),
+                                      ('other', ['other'])]:
+            vocab = model.Vocabulary(vocab_name)
+            self.session.add(vocab)
+            self.session.flush()
+            for tag_name in tag_names:
+                self.session.add(model.Tag(tag_name, vocab.id))
+        self.session.commit()
+
+        self.assertEqual(plugin.query_vocabulary_tags(), {
+            'spheres': ['national', 'provincial'],
+            'provinces': [],
+        })
+
+
+@patch('ckanext.satreasury.plugin.travis.build_trigger_enabled',
+       return_value=False)
+class TestActiveFinancialYearsInvalidation(unittest.TestCase):
+    def setUp(self):
+        self.plugin = SATreasuryDatasetPlugin()
+        self.package = Mock(spec=model.Package)
+        self.package.get_tags.return_value = []
+        self.vocab = Mock(spec=model.Vocabulary)
+        p = patch.object(plugin.model.Vocabulary, 'get',
+                         return_value=self.vocab)
+        p.start()
+        self.addCleanup(p.stop)
+        plugin.helpers.facet_cache.clear()
+        self.addCleanup(plugin.helpers.facet_cache.clear)
+        plugin.helpers.facet_cache.set('active_financial_years', ['2017-18'])
+
+    def cached(self):
+        return plugin.helpers.facet_cache.get('active_financial_years')
+
+    def test_financial_year_tagged_package_invalidates(self, enabled):
+        self.package.get_tags.return_value = [Mock(name='2018-19')]
+        self.plugin.notify(self.package, model.DomainObjectOperation.changed)
+        self.assertIsNone(self.cached())
+        self.package.get_tags.assert_called_with(self.vocab)
+
+    def test_new_package_invalidates(self, enabled):
+        self.plugin.notify(self.package, model.DomainObjectOperation.new)
+        self.assertIsNone(self.cached())
+
+    def test_unrelated_edit_keeps_financial_years(self, enabled):
+        self.plugin.notify(self.package, model.DomainObjectOperation.changed)
+        self.assertEqual(self.cached(), ['2017-18'])
+
+    def test_resources_keep_financial_years(self, enabled):
+        self.plugin.notify(Mock(spec=model.Resource),
+                           model.DomainObjectOperation.new)
+        self.assertEqual(self.cached(), ['2017-18'])
@@ -0,0 +1,472 @@
+import shutil
+import tempfile
+import unittest
+
+import json
+
+import requests
+import responses
+from ckanext.satreasury import cache, manifest, rebuild, travis
+from ckanext.satreasury.cache import MemoryBackend
+from ckanext.satreasury.tests.helpers import FakeClock
+from mock import Mock, patch
+
+TRAVIS_ENDPOINT = "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal"
+TRAVIS_COMMIT_MESSAGE = 'Rebuild with new/modified dataset'
+
+
+def patch_manifest(test):
+    tmp_dir = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, tmp_dir)
+    test.manifest = manifest.RebuildManifest(tmp_dir + '/manifest.json')
+    manifest_patch = patch.object(manifest, 'get_manifest',
+                                  return_value=test.manifest)
+    manifest_patch.start()
+    test.addCleanup(manifest_patch.stop)
+
+
+class TestRebuildStaticSite(unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend()
+        backend_patch = patch.object(cache, '_shared_backend', self.backend)
+        backend_patch.start()
+        self.addCleanup(backend_patch.stop)
+        patch_manifest(self)
+
+    def test_already_building(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/builds",
+                json={
+                    'builds': [
+                        {
+                            'id': 535878234,
+                            'commit': {
+                                'message': TRAVIS_COMMIT_MESSAGE
+                            },
+                        }]},
+                status=200,
+                content_type='application/json')
+            build = rebuild.rebuild_static_site()
+            self.assertEqual(build['id'], 535878234)
+
+    def test_build_triggered(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/builds",
+                json={
+                    'builds': []},
+                status=200,
+                content_type='application/json')
+            rsps.add(
+                responses.POST,
+                TRAVIS_ENDPOINT + "/requests",
+                json={
+                    'request': {
+                        'id': 12345}},
+                status=200,
+                content_type='application/json')
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/request/12345",
+                json={
+                    'builds': [
+                        {
+                            'commit': {
+                                'message': TRAVIS_COMMIT_MESSAGE},
+                            'id': 535878234,
+                        }]},
+                status=200,
+                content_type='application/json')
+
+            build = rebuild.rebuild_static_site()
+            self.assertEqual(build['id'], 535878234)
+
+    def test_already_building_with_new_changes(self):
+        self.manifest.record({
+            'datasets': ['pkg-1'],
+            'organizations': ['org-1'],
+            'financial_years': ['2018-19'],
+        })
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/builds",
+                json={
+                    'builds': [
+                        {
+                            'id': 535878234,
+                            'commit': {
+                                'message': TRAVIS_COMMIT_MESSAGE
+                            },
+                        }]},
+                status=200,
+                content_type='application/json')
+            rsps.add(
+                responses.POST,
+                TRAVIS_ENDPOINT + "/requests",
+                json={
+                    'request': {
+                        'id': 12346}},
+                status=200,
+                content_type='application/json')
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/request/12346",
+                json={
+                    'builds': [{'id': 535878235}]},
+                status=200,
+                content_type='application/json')
+
+            build = rebuild.rebuild_static_site()
+            self.assertEqual(build['id'], 535878235)
+            env = json.loads(rsps.calls[1].request.body)['request']['config']['env']
+            self.assertEqual(env, {
+                'REMOTE_TRIGGER': 'true',
+                'REBUILD_MODE': 'incremental',
+                'CHANGED_DATASETS': 'pkg-1',
+                'CHANGED_ORGANIZATIONS': 'org-1',
+                'CHANGED_FINANCIAL_YEARS': '2018-19',
+            })
+        # Until the build passes
+        self.assertEqual(self.manifest.read()['datasets'].keys(), ['pkg-1'])
+
+    def test_build_request_but_no_build(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/builds",
+                json={
+                    'builds': []},
+                status=200,
+                content_type='application/json')
+            rsps.add(
+                responses.POST,
+                TRAVIS_ENDPOINT + "/requests",
+                json={
+                    'request': {
+                        'id': 12345}},
+                status=200,
+                content_type='application/json')
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/request/12345",
+                json={
+                    'builds': []},
+                status=200,
+                content_type='application/json')
+
+            self.assertIsNone(rebuild.rebuild_static_site())
+
+    def test_queued_builds_are_shared(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/builds",
+                json={
+                    'builds': []},
+                status=200,
+                content_type='application/json')
+            rsps.add(
+                responses.POST,
+                TRAVIS_ENDPOINT + "/requests",
+                json={
+                    'request': {
+                        'id': 12345}},
+                status=200,
+                content_type='application/json')
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/request/12345",
+                json={
+                    'builds': []},
+                status=200,
+                content_type='application/json')
+
+            self.assertIsNone(rebuild.rebuild_static_site())
+            # Another worker sees the build we triggered without asking Travis
+            # for the queued builds again
+            build = rebuild.rebuild_static_site()
+            self.assertEqual(build, {'request_id': 12345})
+            self.assertEqual(
+                [call.request.method for call in rsps.calls],
+                ['GET', 'POST', 'GET', 'GET'])
+            self.assertIn('/request/12345', rsps.calls[-1].request.url)
+
+    def test_build_trigger_errored(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/builds",
+                json={
+                    'builds': []},
+                status=200,
+                content_type='application/json')
+            rsps.add(
+                responses.POST,
+                TRAVIS_ENDPOINT + "/requests",
+                json={
+                    'request': {
+                        'id': 12345}},
+                status=500,
+                content_type='application/json')
+
+            with self.assertRaises(requests.exceptions.HTTPError):
+                rebuild.rebuild_static_site()
+
+
+class TestTriggeredBuildOutcome(unittest.TestCase):
+    """ Changes are kept in the manifest until the build covering them
+    passes.
+    """
+
+    def setUp(self):
+        self.backend = MemoryBackend()
+        backend_patch = patch.object(cache, '_shared_backend', self.backend)
+        backend_patch.start()
+        self.addCleanup(backend_patch.stop)
+        patch_manifest(self)
+        self.clock = FakeClock()
+        self.manifest.clock = self.clock
+
+    def trigger(self, mode='incremental'):
+        """ Record that pkg-1 changed and a build was triggered for it, then
+        that pkg-2 changed.
+        """
+        self.manifest.record({'datasets': ['pkg-1']})
+        self.backend.set(rebuild.TRIGGERED_KEY, {
+            'request_id': 12345,
+            'mode': mode,
+            'changed': self.manifest.read(),
+        })
+        self.clock.now += 1
+        self.manifest.record({'datasets': ['pkg-2']})
+
+    def rebuild(self, state, queued=()):
+        """ Rebuild once the triggered build is in state, returning the
+        environment of the build triggered, if any.
+        """
+        with responses.RequestsMock(assert_all_requests_are_fired=False) \
+                as rsps:
+            rsps.add(responses.GET, TRAVIS_ENDPOINT + "/request/12345",
+                     json={'builds': [{'id': 1, 'state': state}]})
+            rsps.add(responses.GET, TRAVIS_ENDPOINT + "/builds",
+                     json={'builds': [
+                         {'id': id, 'commit': {
+                             'message': TRAVIS_COMMIT_MESSAGE}}
+                         for id in queued]})
+            rsps.add(responses.POST, TRAVIS_ENDPOINT + "/requests",
+                     json={'request': {'id': 12346}})
+            rsps.add(responses.GET, TRAVIS_ENDPOINT + "/request/12346",
+                     json={'builds': [{'id': 2}]})
+            rebuild.rebuild_static_site()
+            for call in rsps.calls:
+                if call.request.method == 'POST':
+                    return json.loads(call.request.body)[
+                        'request']['config']['env']
+        return None
+
+    def test_passed_build_changes_are_forgotten(self):
+        self.trigger()
+        env = self.rebuild('passed')
+        self.assertEqual(env['CHANGED_DATASETS'], 'pkg-2')
+        self.assertEqual(self.backend.get(rebuild.TRIGGERED_KEY)['request_id'],
+                         12346)
+
+    def test_failed_build_changes_are_rebuilt(self):
+        self.trigger()
+        env = self.rebuild('failed')
+        self.assertEqual(env['CHANGED_DATASETS'], 'pkg-1,pkg-2')
+        self.assertEqual(sorted(self.manifest.read()['datasets']),
+                         ['pkg-1', 'pkg-2'])
+
+    def test_failed_full_rebuild_is_followed_by_a_full_rebuild(self):
+        self.trigger(mode='full')
+        env = self.rebuild('errored')
+        self.assertNotIn('REBUILD_MODE', env)
+        self.assertEqual(self.backend.get(rebuild.TRIGGERED_KEY)['mode'],
+                         'full')
+        self.assertIsNone(self.backend.get(rebuild.FORCE_FULL_KEY))
+
+    def test_no_build_while_a_full_rebuild_is_queued(self):
+        self.trigger(mode='full')
+        self.assertIsNone(self.rebuild('created', queued=[1]))
+        # Forgotten once the full rebuild passes
+        self.assertEqual(
+            sorted(self.backend.get(rebuild.TRIGGERED_KEY)['changed']
+                   ['datasets']),
+            ['pkg-1', 'pkg-2'])
+
+    def test_new_changes_while_incremental_build_queued(self):
+        self.trigger()
+        env = self.rebuild('created', queued=[1])
+        self.assertEqual(env['CHANGED_DATASETS'], 'pkg-1,pkg-2')
+
+    def test_no_new_changes_while_incremental_build_queued(self):
+        self.manifest.record({'datasets': ['pkg-1']})
+        self.backend.set(rebuild.TRIGGERED_KEY, {
+            'request_id': 12345,
+            'mode': 'incremental',
+            'changed': self.manifest.read(),
+        })
+        self.assertIsNone(self.rebuild('created', queued=[1]))
+
+
+class TestRebuildScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.enqueue = Mock()
+        self.breaker = travis.CircuitBreaker(
+            failure_threshold=2,
+            cooldown=300,
+            backend=MemoryBackend(clock=self.clock),
+            clock=self.clock)
+        self.scheduler = rebuild.RebuildScheduler(
+            MemoryBackend(clock=self.clock),
+            quiet_period=60,
+            max_delay=600,
+            breaker=self.breaker,
+            clock=self.clock,
+            sleep=self.clock.sleep,
+            enqueue=self.enqueue)
+        breaker_patch = patch.object(travis, 'breaker', self.breaker)
+        breaker_patch.start()
+        self.addCleanup(breaker_patch.stop)
+        backend_patch = patch.object(cache, '_shared_backend', MemoryBackend())
+        backend_patch.start()
+        self.addCleanup(backend_patch.stop)
+        patch_manifest(self)
+
+    def add_travis_responses(self, rsps):
+        rsps.add(
+            responses.GET,
+            TRAVIS_ENDPOINT + "/builds",
+            json={'builds': []},
+            status=200,
+            content_type='application/json')
+        rsps.add(
+            responses.POST,
+            TRAVIS_ENDPOINT + "/requests",
+            json={'request': {'id': 12345}},
+            status=200,
+            content_type='application/json')
+        rsps.add(
+            responses.GET,
+            TRAVIS_ENDPOINT + "/request/12345",
+            json={'builds': [{'id': 535878234}]},
+            status=200,
+            content_type='application/json')
+
+    def test_bulk_edit_triggers_one_build(self):
+        for i in range(200):
+            self.scheduler.request_rebuild()
+            self.clock.now += 1
+        self.assertEqual(self.enqueue.call_count, 1)
+
+        with responses.RequestsMock() as rsps:
+            self.add_travis_responses(rsps)
+            build = self.scheduler.run()
+            posts = [c for c in rsps.calls if c.request.method == 'POST']
+            self.assertEqual(len(posts), 1)
+        self.assertEqual(build['id'], 535878234)
+        # Waited for the quiet period after the last edit
+        self.assertEqual(self.clock.now, 1000.0 + 199 + 60)
+
+    def test_changes_while_waiting_extend_the_wait(self):
+        self.scheduler.request_rebuild()
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            self.clock.sleep(seconds)
+            if len(sleeps) == 1:
+                self.clock.now -= 30
+                self.scheduler.request_rebuild()
+                self.clock.now += 30
+        self.scheduler.sleep = sleep
+
+        with responses.RequestsMock() as rsps:
+            self.add_travis_responses(rsps)
+            self.scheduler.run()
+        self.assertEqual(sleeps, [60, 30])
+
+    def test_max_delay_bounds_the_wait(self):
+        self.scheduler.request_rebuild()
+
+        def sleep(seconds):
+            self.clock.sleep(min(seconds, 50))
+            self.scheduler.request_rebuild()
+        self.scheduler.sleep = sleep
+
+        with responses.RequestsMock() as rsps:
+            self.add_travis_responses(rsps)
+            self.scheduler.run()
+        self.assertEqual(self.clock.now, 1000.0 + 600)
+
+    def test_requests_after_run_schedule_again(self):
+        self.scheduler.request_rebuild()
+        with responses.RequestsMock() as rsps:
+            self.add_travis_responses(rsps)
+            self.scheduler.run()
+        self.assertTrue(self.scheduler.request_rebuild())
+        self.assertEqual(self.enqueue.call_count, 2)
+
+    def test_travis_unavailable_leaves_rebuild_pending(self):
+        self.scheduler.request_rebuild()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/builds",
+                json={},
+                status=503,
+                content_type='application/json')
+            self.assertIsNone(self.scheduler.run())
+        self.assertTrue(self.scheduler.rebuild_pending())
+        # Another job is queued to retry
+        self.assertEqual(self.enqueue.call_count, 2)
+
+    def test_pending_rebuild_issued_when_breaker_closes(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open())
+
+        self.scheduler.request_rebuild()
+        self.assertTrue(self.scheduler.rebuild_pending())
+
+        with responses.RequestsMock() as rsps:
+            self.add_travis_responses(rsps)
+            build = self.scheduler.run()
+        self.assertEqual(build['id'], 535878234)
+        # Waited out the cooldown rather than the quiet period
+        self.assertEqual(self.clock.now, 1000.0 + 300)
+        self.assertFalse(self.scheduler.rebuild_pending())
+        self.assertFalse(self.breaker.is_open())
+
+    def test_bad_request_is_not_retried(self):
+        self.scheduler.request_rebuild()
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.GET,
+                TRAVIS_ENDPOINT + "/builds",
+                json={},
+                status=403,
+                content_type='application/json')
+            with self.assertRaises(requests.exceptions.HTTPError):
+                self.scheduler.run()
+        self.assertEqual(self.enqueue.call_count, 1)
+
+
+class TestEnqueueScheduledRebuild(unittest.TestCase):
+    @patch.object(cache, '_shared_backend', MemoryBackend())
+    @patch.object(rebuild.jobs, 'get_queue')
+    def test_rebuild_jobs_have_their_own_queue(self, get_queue):
+        job = rebuild.enqueue_scheduled_rebuild()
+
+        get_queue.assert_called_once_with('satreasury_rebuild')
+        enqueue_call = get_queue.return_value.enqueue_call
+        self.assertIs(job, enqueue_call.return_value)
+        self.assertIs(enqueue_call.call_args[1]['func'],
+                      rebuild.run_scheduled_rebuild)
+        self.assertGreater(enqueue_call.call_args[1]['timeout'], 600)
@@ -0,0 +1,477 @@
+import copy
+import json
+import unittest
+
+import ckan.model as model
+import pysolr
+from mock import MagicMock, patch
+
+from ckanext.satreasury import facets, helpers, search_plugin
+from ckanext.satreasury.cache import LRUCache
+
+
+class ParameterPlugin(object):
+    def update_valid_solr_parameters(self, valid_solr_parameters):
+        valid_solr_parameters.add('extra_param')
+        return valid_solr_parameters
+
+
+class RawResultsPlugin(object):
+    def include_raw_solr_results(self, data_dict):
+        return True
+
+
+class TestSearchCapabilities(unittest.TestCase):
+    def setUp(self):
+        search_plugin.reset_search_capabilities()
+        self.addCleanup(search_plugin.reset_search_capabilities)
+        patcher = patch.object(search_plugin.plugins, 'PluginImplementations')
+        self.implementations = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.raw = RawResultsPlugin()
+        self.implementations.return_value = [ParameterPlugin(), self.raw]
+
+    def test_plugins_are_inspected_once(self):
+        capabilities = search_plugin.search_capabilities()
+        search_plugin.search_capabilities()
+
+        self.assertEqual(self.implementations.call_count, 1)
+        self.assertIn('extra_param', capabilities.valid_solr_parameters)
+        self.assertIn('q', capabilities.valid_solr_parameters)
+        self.assertEqual(capabilities.raw_solr_results_plugins, (self.raw,))
+
+    def test_module_parameters_are_not_modified(self):
+        search_plugin.search_capabilities()
+        self.assertNotIn('extra_param', search_plugin.VALID_SOLR_PARAMETERS)
+
+    def test_plugin_load_resets_capabilities(self):
+        search_plugin.search_capabilities()
+        self.implementations.return_value = []
+
+        search_plugin.SATreasurySearchPlugin().after_load(None)
+
+        capabilities = search_plugin.search_capabilities()
+        self.assertNotIn('extra_param', capabilities.valid_solr_parameters)
+        self.assertEqual(capabilities.raw_solr_results_plugins, ())
+
+
+PACKAGE = {
+    'name': 'eastern-cape-budget',
+    'title': 'Eastern Cape Budget',
+    'notes': 'Long description',
+    'organization': {'name': 'eastern-cape', 'description': 'x'},
+    'resources': [
+        {'id': 'r1', 'url': 'http://example.com/1.pdf', 'description': 'x'},
+        {'id': 'r2', 'url': 'http://example.com/2.pdf', 'description': 'y'},
+    ],
+}
+
+
+class TestFieldProjection(unittest.TestCase):
+    def after_search(self, extras):
+        search_results = {'results': [dict(PACKAGE)], 'count': 1}
+        return search_plugin.SATreasurySearchPlugin().after_search(
+            search_results, {'extras': extras})
+
+    def test_keeps_selected_fields(self):
+        results = self.after_search(
+            {'ext_fields': 'name, title,resources.url,organization.name,'
+                           'missing'})['results']
+        self.assertEqual(results, [{
+            'name': 'eastern-cape-budget',
+            'title': 'Eastern Cape Budget',
+            'organization': {'name': 'eastern-cape'},
+            'resources': [{'url': 'http://example.com/1.pdf'},
+                          {'url': 'http://example.com/2.pdf'}],
+        }])
+
+    def test_whole_field_wins_over_nested_fields(self):
+        for fields in ['resources.url,resources', 'resources,resources.url']:
+            results = self.after_search({'ext_fields': fields})['results']
+            self.assertEqual(results, [{'resources': PACKAGE['resources']}])
+
+    def test_all_fields_without_projection(self):
+        self.assertEqual(self.after_search({})['results'], [PACKAGE])
+
+    def test_highlighting_is_kept(self):
+        projection = search_plugin.parse_fields('name,resources.url')
+        search_plugin.keep_highlighting(projection)
+        self.assertEqual(projection, {
+            'name': None,
+            'highlighting': None,
+            'resources': set(['url', 'highlighting']),
+        })
+
+
+class TestFacetTitles(unittest.TestCase):
+    def setUp(self):
+        search_plugin.facet_title_cache.clear()
+        self.addCleanup(search_plugin.facet_title_cache.clear)
+        self.session = MagicMock()
+        self.session.query.return_value.filter.return_value.all.return_value = [
+            ('eastern-cape', 'Eastern Cape')]
+
+    def test_group_titles_are_only_queried_once(self):
+        for i in range(2):
+            titles = search_plugin.group_titles(
+                self.session, ['eastern-cape', 'missing'])
+            self.assertEqual(titles, {'eastern-cape': 'Eastern Cape',
+                                      'missing': None})
+        self.assertEqual(self.session.query.call_count, 1)
+
+    def test_group_changes_clear_titles(self):
+        plugin = search_plugin.SATreasurySearchPlugin()
+        search_plugin.group_titles(self.session, ['eastern-cape'])
+
+        plugin.edit(search_plugin.model.Package())
+        search_plugin.group_titles(self.session, ['eastern-cape'])
+        self.assertEqual(self.session.query.call_count, 1)
+
+        plugin.edit(search_plugin.model.Group())
+        search_plugin.group_titles(self.session, ['eastern-cape'])
+        self.assertEqual(self.session.query.call_count, 2)
+
+    def test_licenses_by_id(self):
+        licenses = search_plugin.licenses_by_id()
+        self.assertEqual(licenses['cc-by'].id, 'cc-by')
+        self.assertIs(search_plugin.licenses_by_id(), licenses)
+
+
+class SolrTestCase(unittest.TestCase):
+    """ Replaces Solr with a mock returning ``solr_response`` and recording
+    the queries sent to it.
+    """
+    solr_response = {'response': {'numFound': 0, 'docs': []}}
+
+    def setUp(self):
+        self.solr = MagicMock()
+        self.solr.search.side_effect = \
+            lambda **query: pysolr.Results(copy.deepcopy(self.solr_response))
+        for p in [
+                patch.object(search_plugin, 'make_connection',
+                             return_value=self.solr),
+                patch.dict(search_plugin.config, {'ckan.site_id': 'test'}),
+                patch.object(search_plugin, '_check_access')]:
+            p.start()
+            self.addCleanup(p.stop)
+
+    @property
+    def solr_query(self):
+        return self.solr.search.call_args[1]
+
+
+class TestFacetCounts(SolrTestCase):
+    solr_response = {
+        'response': {'numFound': 12, 'docs': []},
+        'facet_counts': {'facet_fields': {
+            'vocab_financial_years': ['2017-18', 10, '2018-19', 2]}},
+    }
+
+    def test_counts_from_a_single_query(self):
+        result = search_plugin.facet_counts({'ignore_auth': True}, {
+            'facet.field': '["vocab_financial_years"]',
+            'fq': 'organization:eastern-cape',
+        })
+
+        self.assertEqual(result, {
+            'count': 12,
+            'facets': {'vocab_financial_years': {'2017-18': 10, '2018-19': 2}},
+        })
+        self.assertEqual(self.solr.search.call_count, 1)
+        query = self.solr_query
+        self.assertEqual(query['rows'], 0)
+        self.assertEqual(query['facet.field'], ['vocab_financial_years'])
+        self.assertEqual(query['fq'], [
+            'capacity:public', 'organization:eastern-cape', 'site_id:"test"',
+            'state:active'])
+
+    @patch.object(search_plugin.lib_plugins, 'get_permission_labels')
+    def test_filters_by_permission_labels(self, get_permission_labels):
+        get_permission_labels.return_value.get_user_dataset_labels \
+            .return_value = ['public', 'member-org-1']
+        search_plugin.facet_counts(
+            {'user': None, 'auth_user_obj': None},
+            {'facet.field': ['organization'], 'include_private': True})
+
+        self.assertEqual(self.solr_query['fq'], [
+            'permission_labels:("member-org-1" OR "public")', 'site_id:"test"',
+            'state:active'])
+
+    @patch.object(search_plugin, '_', lambda message: message)
+    def test_facet_fields_must_be_a_list(self):
+        with self.assertRaises(search_plugin.ValidationError):
+            search_plugin.facet_counts({'ignore_auth': True},
+                                       {'facet.field': 'organization'})
+
+
+class TestSearchFilters(SolrTestCase):
+    def test_each_constraint_is_a_separate_filter(self):
+        search_plugin.PackageSearchQuery().run({
+            'q': 'budget',
+            'fq': '+capacity:public vocab_financial_years:"2017-18" '
+                  '+state:(active OR draft)',
+            'fq_list': ['+capacity:public', 'organization:eastern-cape'],
+        }, permission_labels=['public'])
+
+        self.assertEqual(self.solr_query['fq'], [
+            'capacity:public',
+            'organization:eastern-cape',
+            'permission_labels:("public")',
+            'site_id:"test"',
+            'state:(active OR draft)',
+            'vocab_financial_years:"2017-18"',
+        ])
+        self.assertNotIn('fq_list', self.solr_query)
+
+    def test_only_explicit_state_filters_replace_the_default(self):
+        search_plugin.PackageSearchQuery().run({'fq': 'state:draft'})
+        self.assertEqual(self.solr_query['fq'], [
+            'site_id:"test"', 'state:active', 'state:draft'])
+
+        search_plugin.PackageSearchQuery().run({'fq': '+state:draft'})
+        self.assertEqual(self.solr_query['fq'], [
+            'site_id:"test"', 'state:draft'])
+
+    def test_filters_are_the_same_however_they_are_combined(self):
+        search_plugin.PackageSearchQuery().run(
+            {'fq': 'organization:a +capacity:public'})
+        first = self.solr_query['fq']
+        search_plugin.PackageSearchQuery().run(
+            {'fq_list': ['capacity:public', '+organization:a']})
+        self.assertEqual(self.solr_query['fq'], first)
+
+
+class TestFacetParameters(SolrTestCase):
+    def test_per_field_options(self):
+        with patch.dict(facets.FIELD_OPTIONS,
+                        {'res_format': {'facet.limit': 20}}):
+            search_plugin.PackageSearchQuery().run({
+                'facet.field': ['vocab_financial_years', 'res_format',
+                                'organization'],
+            })
+
+        query = self.solr_query
+        self.assertEqual(query['facet'], 'true')
+        self.assertEqual(query['f.vocab_financial_years.facet.method'], 'enum')
+        self.assertEqual(query['f.vocab_financial_years.facet.limit'], -1)
+        self.assertEqual(query['f.res_format.facet.limit'], 20)
+        self.assertNotIn('f.organization.facet.limit', query)
+
+    def test_limit_asked_for_applies_to_every_field(self):
+        search_plugin.PackageSearchQuery().run({
+            'facet.field': ['vocab_financial_years'], 'facet.limit': 5})
+        self.assertEqual(self.solr_query['facet.limit'], 5)
+        self.assertNotIn('f.vocab_financial_years.facet.limit', self.solr_query)
+
+    def test_faceting_off_without_facet_fields(self):
+        search_plugin.PackageSearchQuery().run({'q': 'budget'})
+        self.assertEqual(self.solr_query['facet'], 'false')
+        self.assertNotIn('facet.limit', self.solr_query)
+
+
+class TestCursorPaging(SolrTestCase):
+    solr_response = {
+        'response': {'numFound': 3, 'docs': [
+            {'id': 'a', 'name': 'a'}, {'id': 'b', 'name': 'b'}]},
+        'nextCursorMark': 'AoE',
+    }
+
+    def test_no_row_is_over_fetched_with_a_cursor(self):
+        query = search_plugin.PackageSearchQuery()
+        query.run({'rows': 2, 'sort': 'name asc', 'cursorMark': '*'})
+
+        self.assertEqual(self.solr_query['rows'], 2)
+        self.assertEqual(self.solr_query['sort'], 'name asc, index_id asc')
+        self.assertEqual(len(query.results), 2)
+        self.assertEqual(query.next_cursor_mark, 'AoE')
+
+    def test_over_fetched_row_is_skipped_without_a_cursor(self):
+        query = search_plugin.PackageSearchQuery()
+        query.run({'rows': 1, 'sort': 'name asc'})
+
+        self.assertEqual(self.solr_query['rows'], 2)
+        self.assertEqual(self.solr_query['sort'], 'name asc')
+        self.assertEqual(query.results, ['a'])
+
+
+class TestFinancialYearPackages(unittest.TestCase):
+    def setUp(self):
+        p = patch.object(search_plugin.tk, 'get_action')
+        self.package_search = p.start().return_value
+        self.addCleanup(p.stop)
+        self.package_search.return_value = {
+            'results': [], 'count': 0, 'next_cursor_mark': 'AoE'}
+
+    def test_page_from_cursor(self):
+        result = search_plugin.financial_year_packages({}, {
+            'financial_year': '2017-18', 'cursor': 'AoA', 'rows': '5000'})
+
+        self.assertEqual(result, {'results': [], 'count': 0,
+                                  'next_cursor': 'AoE'})
+        self.assertEqual(self.package_search.call_args[0][1], {
+            'fq': 'vocab_financial_years:"2017-18"',
+            'rows': 1000,
+            'sort': 'name asc',
+            'cursorMark': 'AoA',
+        })
+
+    @patch.object(search_plugin, '_', lambda message: message)
+    def test_rows_must_be_a_natural_number(self):
+        for rows in ['abc', '-1', None]:
+            with self.assertRaises(search_plugin.ValidationError):
+                search_plugin.financial_year_packages(
+                    {}, {'financial_year': '2017-18', 'rows': rows})
+        self.assertFalse(self.package_search.called)
+
+
+class TestIterPackagesForFinancialYear(unittest.TestCase):
+    def setUp(self):
+        p = patch.object(helpers.tk, 'get_action')
+        self.get_page = p.start().return_value
+        self.addCleanup(p.stop)
+
+    def pages(self, financial_year='2017-18'):
+        return list(helpers.iter_packages_for_financial_year(
+            financial_year, page_size=2))
+
+    def test_pages_until_the_cursor_stops_changing(self):
+        self.get_page.side_effect = [
+            {'results': ['a', 'b'], 'next_cursor': 'c1'},
+            {'results': ['c'], 'next_cursor': 'c2'},
+            {'results': ['c'], 'next_cursor': 'c2'},
+        ]
+        self.assertEqual(self.pages(), ['a', 'b', 'c', 'c'])
+        self.assertEqual(
+            [call[0][1]['cursor'] for call in self.get_page.call_args_list],
+            ['*', 'c1', 'c2'])
+        self.assertEqual(self.get_page.call_args[0][0], {'lazy_results': True})
+
+    def test_stops_at_an_empty_page(self):
+        self.get_page.side_effect = [
+            {'results': ['a'], 'next_cursor': 'c1'},
+            {'results': [], 'next_cursor': 'c2'},
+        ]
+        self.assertEqual(self.pages(), ['a'])
+        self.assertEqual(self.get_page.call_count, 2)
+
+
+class TestSearchCache(SolrTestCase):
+    solr_response = {'response': {'numFound': 1, 'docs': [
+        {'id': 'a', 'validated_data_dict': json.dumps({'name': 'a'})}]}}
+
+    def setUp(self):
+        super(TestSearchCache, self).setUp()
+        self.cache = LRUCache(max_size=10, ttl=300)
+        self.labels = {'alice': ['public', 'member-org-1'],
+                       'bob': ['public']}
+        for p in [
+                patch.object(search_plugin, 'search_cache', self.cache),
+                patch.object(search_plugin.plugins, 'PluginImplementations',
+                             return_value=[]),
+                patch.object(search_plugin.lib_plugins,
+                             'get_permission_labels'),
+                patch.object(search_plugin.authz, 'is_sysadmin',
+                             return_value=False)]:
+            p.start()
+            self.addCleanup(p.stop)
+        search_plugin.lib_plugins.get_permission_labels.return_value \
+            .get_user_dataset_labels.side_effect = self.labels.get
+
+    def search(self, user):
+        return search_plugin.package_search({
+            'model': model, 'session': MagicMock(), 'user': user,
+            'auth_user_obj': user}, {'q': 'budget', 'include_private': True})
+
+    def test_repeated_search_is_served_from_the_cache(self):
+        first = self.search('alice')
+        first['results'].append('modified by the caller')
+
+        self.assertEqual(self.search('alice')['results'], [{'name': 'a'}])
+        self.assertEqual(self.solr.search.call_count, 1)
+        self.assertEqual(self.cache.stats(), {
+            'hits': 1, 'misses': 1, 'size': 1, 'max_size': 10})
+
+    def test_users_who_can_see_different_datasets_are_cached_apart(self):
+        self.search('alice')
+        self.search('bob')
+
+        self.assertEqual(self.solr.search.call_count, 2)
+        self.assertIn('permission_labels:("public")', self.solr_query['fq'])
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+    def test_each_language_is_cached_apart(self):
+        for lang in [['en'], ['af'], ['en']]:
+            with patch.object(search_plugin, 'get_lang', return_value=lang):
+                self.search('alice')
+
+        self.assertEqual(self.solr.search.call_count, 2)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_changes_clear_the_cache(self):
+        self.search('alice')
+        search_plugin.SATreasurySearchPlugin().notify(
+            model.Package(), model.DomainObjectOperation.changed)
+        self.search('alice')
+        self.assertEqual(self.solr.search.call_count, 2)
+
+    def test_stats(self):
+        self.search('alice')
+        stats = search_plugin.search_stats({}, {})
+        self.assertEqual(stats['search_cache']['misses'], 1)
+        self.assertIn('solr_connections', stats)
+
+
+class TestAssignHighlighting(unittest.TestCase):
+    def test_resource_highlights_are_moved_to_their_resource(self):
+        packages = [{'resources': [{'id': 'r1'}, {'id': 'r2'}]}]
+        highlighting = {'index-1': {
+            'title': ['<em>Budget</em>'],
+            'ckanext-extractor_r2_fulltext': ['the <em>budget</em>'],
+            'ckanext-extractor_deleted_fulltext': ['old <em>budget</em>'],
+        }}
+
+        search_plugin.assign_highlighting(
+            packages, [{'index_id': 'index-1'}], highlighting)
+
+        self.assertEqual(packages, [{
+            'highlighting': {'title': ['<em>Budget</em>']},
+            'resources': [
+                {'id': 'r1', 'highlighting': {}},
+                {'id': 'r2',
+                 'highlighting': {'fulltext': ['the <em>budget</em>']}},
+            ],
+        }])
+
+
+class TestHighlightParameters(unittest.TestCase):
+    def before_search(self, **extras):
+        extras['ext_highlight'] = 'true'
+        return search_plugin.SATreasurySearchPlugin().before_search(
+            {'q': 'budget', 'extras': extras})
+
+    def test_bounded_defaults(self):
+        params = self.before_search()
+        self.assertEqual(params['hl.fl'],
+                         'title notes ckanext-extractor_*_fulltext')
+        self.assertEqual(params['hl.maxAnalyzedChars'], 51200)
+        self.assertEqual(params['hl.snippets'], 5)
+        self.assertEqual(params['hl.fragsize'], 200)
+
+    def test_snippets_and_fragsize_within_bounds(self):
+        params = self.before_search(ext_highlight_snippets='2',
+                                    ext_highlight_fragsize='100')
+        self.assertEqual((params['hl.snippets'], params['hl.fragsize']),
+                         (2, 100))
+
+        params = self.before_search(ext_highlight_snippets='1000',
+                                    ext_highlight_fragsize='0')
+        self.assertEqual((params['hl.snippets'], params['hl.fragsize']),
+                         (search_plugin.HIGHLIGHT_MAX_SNIPPETS, 1))
+
+        params = self.before_search(ext_highlight_snippets='many')
+        self.assertEqual(params['hl.snippets'], 5)
+
+    @patch.object(search_plugin, 'HIGHLIGHT_METHOD', 'unified')
+    def test_highlight_method(self):
+        self.assertEqual(self.before_search()['hl.method'], 'unified')
+        self.assertNotIn('hl.offsetSource', self.before_search())
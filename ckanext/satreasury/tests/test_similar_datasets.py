@@ -0,0 +1,99 @@
+import json
+import unittest
+
+import pysolr
+from ckanext.satreasury import cache, similar_datasets_plugin as similar
+from ckanext.satreasury.cache import MemoryBackend
+from ckanext.satreasury.tests.helpers import DatabaseTestCase
+from mock import MagicMock, Mock, patch
+
+
+def solr_docs(*ids):
+    return pysolr.Results({'response': {'numFound': len(ids), 'docs': [
+        {'id': id, 'score': 1.0, 'validated_data_dict': json.dumps({'id': id})}
+        for id in ids]}})
+
+
+class TestSimilarDatasets(unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend()
+        self.solr = MagicMock()
+        self.solr.more_like_this.return_value = solr_docs('b', 'c')
+        for target, name, value in [
+                (cache, '_shared_backend', self.backend),
+                (similar, 'make_connection', Mock(return_value=self.solr)),
+                (similar, 'resolve_package_id', Mock(return_value='a')),
+                (similar, 'config', {'ckan.site_id': 'test'})]:
+            p = patch.object(target, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_live_query_on_miss_is_stored(self):
+        self.assertEqual(similar.get_similar_datasets({}, {'id': 'a'}),
+                         [{'id': 'b'}, {'id': 'c'}])
+        self.assertEqual(self.backend.get('similar_datasets:a'), ['b', 'c'])
+
+    def test_served_from_stored_ids(self):
+        self.backend.set('similar_datasets:a', ['c', 'b', 'private'])
+        self.solr.search.return_value = solr_docs('b', 'c')
+
+        self.assertEqual(similar.get_similar_datasets({}, {'id': 'a'}),
+                         [{'id': 'c'}, {'id': 'b'}])
+        self.assertFalse(self.solr.more_like_this.called)
+        self.assertIn('id:("c" OR "b" OR "private")',
+                      self.solr.search.call_args[1]['fq'])
+
+    def test_no_similar_datasets_stored(self):
+        self.backend.set('similar_datasets:a', [])
+        self.assertEqual(similar.get_similar_datasets({}, {'id': 'a'}), [])
+        self.assertFalse(self.solr.search.called)
+
+    def test_refresh_every_public_dataset(self):
+        self.solr.search.side_effect = [
+            pysolr.Results({'response': {'docs': [{'id': 'a'}, {'id': 'd'}]},
+                            'nextCursorMark': 'next'}),
+            pysolr.Results({'response': {'docs': []},
+                            'nextCursorMark': 'next'}),
+        ]
+        self.assertEqual(similar.refresh_similar_datasets(), 2)
+        self.assertEqual(self.backend.get('similar_datasets:d'), ['b', 'c'])
+        self.assertEqual(self.solr.search.call_args[1]['cursorMark'], 'next')
+
+    @patch.object(similar, 'enqueue_refresh')
+    def test_changed_datasets_are_refreshed(self, enqueue_refresh):
+        plugin = similar.SimilarDatasetsPlugin()
+        self.backend.set('similar_datasets:a', ['b'])
+        self.backend.set('similar_datasets:e', ['b'])
+
+        plugin.notify(similar.model.Package(id='a', state='active',
+                                            private=False), 'changed')
+        plugin.notify(similar.model.Package(id='e', state='deleted',
+                                            private=False), 'deleted')
+
+        enqueue_refresh.assert_called_once_with(['a'])
+        self.assertIsNone(self.backend.get('similar_datasets:e'))
+
+
+class TestResolvePackageId(DatabaseTestCase):
+    tables = ['package']
+
+    def setUp(self):
+        super(TestResolvePackageId, self).setUp()
+        self.session.execute(similar.model.package_table.insert(), [
+            {'id': 'id-1', 'name': 'eastern-cape-budget'},
+            {'id': 'id-2', 'name': 'id-1'},
+        ])
+
+    def test_by_id(self):
+        self.assertEqual(similar.resolve_package_id('id-2'), 'id-2')
+
+    def test_by_name(self):
+        self.assertEqual(similar.resolve_package_id('eastern-cape-budget'),
+                         'id-1')
+
+    def test_id_wins_over_name(self):
+        self.assertEqual(similar.resolve_package_id('id-1'), 'id-1')
+
+    def test_missing_dataset(self):
+        with self.assertRaises(similar.tk.ObjectNotFound):
+            similar.resolve_package_id('missing')
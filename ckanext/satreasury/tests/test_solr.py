@@ -0,0 +1,41 @@
+import unittest
+
+from ckanext.satreasury import solr
+from ckanext.satreasury.tests.helpers import start_stub_server
+from mock import patch
+
+SOLR_RESPONSE = {'response': {'numFound': 1, 'docs': [{'id': 'pkg-1'}]}}
+
+
+class TestSolrConnections(unittest.TestCase):
+    def setUp(self):
+        server = start_stub_server(self, [(200, SOLR_RESPONSE, 0)] * 3)
+        self.server = server
+
+        for target, name, value in [
+                (solr, '_session', None),
+                (solr, '_connections', {}),
+                (solr.SolrSettings, 'get',
+                 staticmethod(lambda: (server.url, None, None)))]:
+            p = patch.object(target, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_connection_is_shared(self):
+        conn = solr.make_connection(decode_dates=False)
+        self.assertIs(solr.make_connection(decode_dates=False), conn)
+        self.assertIsNot(solr.make_connection(), conn)
+        self.assertIs(solr.make_connection().session, conn.session)
+        self.assertEqual(conn.timeout, solr.SOLR_TIMEOUT)
+
+    def test_connections_to_solr_are_reused(self):
+        self.assertEqual(solr.make_connection().search(q='*:*').hits, 1)
+        solr.make_connection(decode_dates=False).search(q='*:*')
+        solr.make_connection().more_like_this(q='id:pkg-1', mltfl='text')
+
+        self.assertEqual(len(self.server.requests), 3)
+        stats = solr.pool_stats().values()
+        self.assertEqual(stats, [{'connections': 1, 'requests': 3, 'idle': 1}])
+
+    def test_no_stats_before_first_query(self):
+        self.assertEqual(solr.pool_stats(), {})
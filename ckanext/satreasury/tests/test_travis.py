@@ -0,0 +1,104 @@
+import time
+import unittest
+
+import requests
+from ckanext.satreasury import cache, travis
+from ckanext.satreasury.cache import MemoryBackend
+from ckanext.satreasury.tests.helpers import start_stub_server
+from mock import patch
+
+
+class TestTravisClient(unittest.TestCase):
+    def start_server(self, responses):
+        server = start_stub_server(self, responses)
+
+        for name, value in [
+                ('TRAVIS_ENDPOINT', server.url + '/repo'),
+                ('TRAVIS_TIMEOUT', (1, 0.2)),
+                ('_session', travis.make_session(retries=2, backoff_factor=0)),
+                ('breaker', travis.CircuitBreaker(
+                    failure_threshold=2, cooldown=60,
+                    backend=MemoryBackend()))]:
+            p = patch.object(travis, name, value)
+            p.start()
+            self.addCleanup(p.stop)
+        p = patch.object(cache, '_shared_backend', MemoryBackend())
+        p.start()
+        self.addCleanup(p.stop)
+        return server
+
+    def test_queued_builds_are_cached(self):
+        server = self.start_server([(200, {'builds': []}, 0)])
+        self.assertEqual(travis.get_queued_builds(), [])
+        self.assertEqual(travis.get_queued_builds(), [])
+        self.assertEqual(len(server.requests), 1)
+
+    def test_retries_server_errors(self):
+        server = self.start_server([
+            (503, {}, 0),
+            (429, {}, 0),
+            (200, {'builds': []}, 0),
+        ])
+        self.assertEqual(travis.get_queued_builds(), [])
+        self.assertEqual(len(server.requests), 3)
+
+    def test_gives_up_after_retries(self):
+        server = self.start_server([(502, {}, 0)] * 3)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            travis.get_queued_builds()
+        self.assertEqual(len(server.requests), 3)
+
+    def test_does_not_retry_build_request(self):
+        server = self.start_server([(500, {}, 0)])
+        with self.assertRaises(requests.exceptions.HTTPError):
+            travis.trigger_build()
+        self.assertEqual(server.requests, [('POST', '/repo/requests')])
+
+    def test_read_timeout(self):
+        server = self.start_server([(200, {}, 0.5)] * 3)
+        start = time.time()
+        with self.assertRaises(requests.exceptions.RequestException):
+            travis.get_queued_builds()
+        # Each attempt gives up after the 0.2s read timeout
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_connection_is_reused(self):
+        self.start_server([(200, {'builds': []}, 0)] * 2)
+        travis.fetch_queued_builds()
+        travis.fetch_queued_builds()
+        pool = travis.get_session().get_adapter(travis.TRAVIS_ENDPOINT) \
+            .poolmanager.connection_from_url(travis.TRAVIS_ENDPOINT)
+        self.assertEqual(pool.num_connections, 1)
+        self.assertEqual(pool.num_requests, 2)
+
+    def test_latency_is_recorded(self):
+        self.start_server([(200, {'request': {'id': 1}}, 0)])
+        before = travis.latency_stats().get('requests', {}).get('count', 0)
+        travis.trigger_build()
+        self.assertEqual(travis.latency_stats()['requests']['count'], before + 1)
+
+        with patch.object(travis, 'log') as log:
+            travis.log_latency_stats()
+        self.assertIn(('requests', before + 1),
+                      [call[0][1:3] for call in log.info.call_args_list])
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        server = self.start_server([(500, {}, 0)] * 2)
+        for i in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                travis.trigger_build()
+        self.assertTrue(travis.breaker.is_open())
+        with self.assertRaises(travis.CircuitOpenError):
+            travis.trigger_build()
+        self.assertEqual(len(server.requests), 2)
+
+    def test_breaker_closes_after_successful_call(self):
+        self.start_server([(200, {'builds': []}, 0)])
+        travis.breaker.record_failure()
+        travis.breaker.record_failure()
+        travis.breaker.backend.set(travis.CircuitBreaker.OPEN_UNTIL_KEY, 0)
+        self.assertFalse(travis.breaker.is_open())
+        self.assertEqual(travis.get_queued_builds(), [])
+        travis.breaker.record_failure()
+        self.assertFalse(travis.breaker.is_open())
@@ -1,10 +1,15 @@
 import logging
 import os
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from ckan.common import config
 import ckan.plugins.toolkit as tk
+from ckanext.satreasury.cache import get_shared_backend
 
 TRAVIS_ENDPOINT = "https://api.travis-ci.org/repo/vulekamali%2Fstatic-budget-portal"
 TRAVIS_COMMIT_MESSAGE = 'Rebuild with new/modified dataset'
@@ -17,10 +22,178 @@ TRAVIS_HEADERS = {
     "Travis-API-Version": "3",
     "Authorization": "token %s" % TRAVIS_TOKEN,
 }
+TRAVIS_TIMEOUT = (
+    float(config.get('satreasury.travis_connect_timeout', 5)),
+    float(config.get('satreasury.travis_read_timeout', 15)),
+)
+TRAVIS_RETRIES = int(config.get('satreasury.travis_retries', 3))
+TRAVIS_RETRY_BACKOFF = float(config.get('satreasury.travis_retry_backoff', 0.5))
+# Rate limiting and server errors are worth retrying. Only idempotent methods
+# are retried once the request has been sent, so a build isn't requested twice.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Queued builds are cached briefly so that bursts of saves from all
+# processes share one lookup.
+QUEUED_BUILDS_KEY = 'travis:queued_builds'
+QUEUED_BUILDS_TTL = float(config.get('satreasury.travis_queue_cache_ttl', 10))
 
 log = logging.getLogger(__name__)
 
 
+class CircuitOpenError(Exception):
+    """ Raised instead of calling Travis while it's considered unavailable.
+    """
+
+
+class CircuitBreaker(object):
+    """ Stops calling Travis for ``cooldown`` seconds after
+    ``failure_threshold`` consecutive failed calls.
+
+    Once the cooldown has passed the next call is let through: if it
+    succeeds the breaker closes, otherwise it opens for another cooldown.
+    State is kept in the shared cache backend so that web and worker
+    processes agree on it.
+    """
+    FAILURES_KEY = 'travis:failures'
+    OPEN_UNTIL_KEY = 'travis:open_until'
+
+    def __init__(self, failure_threshold=5, cooldown=60, backend=None,
+                 clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._backend = backend
+        self.clock = clock
+
+    @property
+    def backend(self):
+        return self._backend or get_shared_backend()
+
+    def seconds_until_retry(self):
+        """ Seconds left in the cooldown, or 0 if calls are let through.
+        """
+        open_until = self.backend.get(self.OPEN_UNTIL_KEY)
+        if open_until is None:
+            return 0
+        return max(0, open_until - self.clock())
+
+    def is_open(self):
+        return self.seconds_until_retry() > 0
+
+    def before_call(self):
+        remaining = self.seconds_until_retry()
+        if remaining:
+            raise CircuitOpenError(
+                "Travis API calls suspended for %ds after repeated failures"
+                % remaining)
+
+    def record_success(self):
+        if self.backend.get(self.FAILURES_KEY):
+            self.backend.delete(self.FAILURES_KEY)
+            self.backend.delete(self.OPEN_UNTIL_KEY)
+
+    def record_failure(self):
+        failures = self.backend.get(self.FAILURES_KEY, 0) + 1
+        self.backend.set(self.FAILURES_KEY, failures)
+        if failures >= self.failure_threshold:
+            log.warning("Suspending Travis API calls for %ds after %d failures",
+                        self.cooldown, failures)
+            self.backend.set(self.OPEN_UNTIL_KEY, self.clock() + self.cooldown)
+
+
+breaker = CircuitBreaker(
+    failure_threshold=int(config.get('satreasury.travis_failure_threshold', 5)),
+    cooldown=float(config.get('satreasury.travis_cooldown', 60)),
+)
+
+_session = None
+_latency_lock = threading.Lock()
+_latency = {}
+
+
+def make_session(retries=TRAVIS_RETRIES, backoff_factor=TRAVIS_RETRY_BACKOFF):
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        # Return the last response so callers can raise_for_status
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(TRAVIS_HEADERS)
+    return session
+
+
+def get_session():
+    """ Module-wide session so connections to Travis are kept alive and reused.
+    """
+    global _session
+    if _session is None:
+        _session = make_session()
+    return _session
+
+
+def request(method, endpoint, path, **kwargs):
+    """ Make a request to the Travis API, recording its latency under
+    ``endpoint``.
+
+    Raises CircuitOpenError without making the request if Travis has been
+    failing.
+    """
+    breaker.before_call()
+    kwargs.setdefault('timeout', TRAVIS_TIMEOUT)
+    start = time.time()
+    try:
+        response = get_session().request(
+            method, TRAVIS_ENDPOINT + path, **kwargs)
+    except requests.exceptions.RequestException:
+        breaker.record_failure()
+        raise
+    finally:
+        elapsed = time.time() - start
+        record_latency(endpoint, elapsed)
+        log.debug("Travis %s %s took %.3fs", method, endpoint, elapsed)
+
+    if response.status_code in RETRY_STATUSES:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+
+def record_latency(endpoint, elapsed):
+    with _latency_lock:
+        stats = _latency.setdefault(endpoint, {
+            'count': 0,
+            'total': 0.0,
+            'max': 0.0,
+        })
+        stats['count'] += 1
+        stats['total'] += elapsed
+        stats['max'] = max(stats['max'], elapsed)
+
+
+def latency_stats():
+    """ Request count, total and maximum latency in seconds per endpoint since
+    the process started.
+    """
+    with _latency_lock:
+        return dict((endpoint, dict(stats))
+                    for endpoint, stats in _latency.items())
+
+
+def log_latency_stats():
+    """ Log the latency of each endpoint's requests, e.g. after each rebuild
+    job, since Travis is called from workers which can't be asked for stats.
+    """
+    for endpoint, stats in sorted(latency_stats().items()):
+        log.info("Travis %s latency: %d requests, %.3fs mean, %.3fs max",
+                 endpoint, stats['count'], stats['total'] / stats['count'],
+                 stats['max'])
+
+
 def build_trigger_enabled():
     return tk.asbool(os.environ.get(
         'CKAN_SATREASURY_BUILD_TRIGGER_ENABLED',
@@ -38,23 +211,40 @@ def get_builds_from_created_request(build_request):
 
 
 def get_request(request_id):
-    r = requests.get(TRAVIS_ENDPOINT + '/request/' +
-                     str(request_id), headers=TRAVIS_HEADERS)
+    r = request('GET', 'request', '/request/' + str(request_id))
     return r.json()
 
 
 def get_queued_builds():
+    """ Builds we've triggered that haven't started yet, cached in the shared
+    cache backend for a few seconds.
+    """
+    builds = get_shared_backend().get(QUEUED_BUILDS_KEY)
+    if builds is None:
+        builds = fetch_queued_builds()
+        set_queued_builds(builds)
+    return builds
+
+
+def set_queued_builds(builds):
+    get_shared_backend().set(QUEUED_BUILDS_KEY, builds, ttl=QUEUED_BUILDS_TTL)
+
+
+def fetch_queued_builds():
     params = {
         "build.state": "created",
         "branch.name": "master",
     }
-    r = requests.get(TRAVIS_ENDPOINT + '/builds',
-                     headers=TRAVIS_HEADERS, params=params)
+    r = request('GET', 'builds', '/builds', params=params)
     r.raise_for_status()
     return list(filter(queued_build_filter, r.json()['builds']))
 
 
-def trigger_build():
+def trigger_build(env=None):
+    """ Request a build, passing it any extra environment variables in env.
+    """
+    build_env = {'REMOTE_TRIGGER': 'true'}
+    build_env.update(env or {})
     payload = {
         'request': {
             'message': TRAVIS_COMMIT_MESSAGE,
@@ -62,17 +252,23 @@ def trigger_build():
             'config': {
                 'merge_mode': 'deep_merge',
                 'branches': {'except': []},
-                'env': {'REMOTE_TRIGGER': 'true'}
+                'env': build_env
             },
         }
     }
-    r = requests.post(TRAVIS_ENDPOINT + '/requests',
-                      json=payload, headers=TRAVIS_HEADERS)
+    r = request('POST', 'requests', '/requests', json=payload)
     log.debug(r.text)
     r.raise_for_status()
-    return r.json()
+    created_request = r.json()
+    # Travis creates the build shortly. Until then, let other processes know
+    # one is on its way so they don't trigger another.
+    set_queued_builds([{'request_id': created_request['request']['id']}])
+    return created_request
 
 
 def get_build_url(build):
+    if 'id' not in build:
+        # Travis hasn't created the build yet
+        return TRAVIS_WEB_URL
     url = TRAVIS_WEB_URL + str(build['id'])
     return url
@@ -86,6 +86,9 @@ setup(
         satreasury-search=ckanext.satreasury.search_plugin:SATreasurySearchPlugin
         satreasury-similar-datasets=ckanext.satreasury.similar_datasets_plugin:SimilarDatasetsPlugin
 
+        [paste.paster_command]
+        satreasury=ckanext.satreasury.commands:SATreasuryCommand
+
         [babel.extractors]
         ckan = ckan.lib.extract:extract_ckan
     ''',